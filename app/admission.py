@@ -0,0 +1,183 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# если ожидаемое ожидание в очереди больше этого — новые задачи не принимаем
+ADMISSION_MAX_WAIT_SEC = float(os.getenv("ADMISSION_MAX_WAIT_SEC") or "1800")
+# жёсткий потолок длины очереди (на случай, если оценки врут)
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE") or "200")
+
+# стартовые оценки длительности, пока нет своей статистики
+DEFAULT_DURATION_SEC = {
+    "chat": 15.0,
+    "image": 40.0,
+    "video": 300.0,
+    "music": 120.0,
+}
+EWMA_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    def __init__(self, estimated_wait_s: float, queue_depth: int):
+        super().__init__("queue overloaded")
+        self.estimated_wait_s = estimated_wait_s
+        self.queue_depth = queue_depth
+
+
+class _Entry:
+    __slots__ = ("jtype", "model", "queued_at", "started_at", "timed")
+
+    def __init__(self, jtype: str, model: str, queued_at: float):
+        self.jtype = jtype
+        self.model = model
+        self.queued_at = queued_at
+        self.started_at: Optional[float] = None
+        # False — старт не видели (задачу нашли в БД уже running): длительность в статистику не пишем
+        self.timed = True
+
+
+class AdmissionController:
+    """
+    Знает, что стоит в очереди и что выполняется, и скользящие средние
+    длительности по (тип, модель). По ним оценивает ожидание и позицию,
+    и отказывает в приёме, когда очередь слишком длинная.
+    """
+
+    def __init__(self, concurrency: int = 1):
+        self.concurrency = max(1, concurrency)
+        self._queued: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._running: Dict[int, _Entry] = {}
+        self._avg: Dict[Tuple[str, str], float] = {}
+        self.rejected = 0
+
+    # ---------- статистика ----------
+
+    def expected_duration(self, jtype: str, model: str = "") -> float:
+        v = self._avg.get((jtype, model or ""))
+        if v is None:
+            v = self._avg.get((jtype, ""))
+        if v is None:
+            v = DEFAULT_DURATION_SEC.get(jtype, 60.0)
+        return v
+
+    def _observe(self, jtype: str, model: str, duration_s: float):
+        for key in ((jtype, model or ""), (jtype, "")):
+            prev = self._avg.get(key)
+            self._avg[key] = duration_s if prev is None else prev + EWMA_ALPHA * (duration_s - prev)
+
+    # ---------- жизненный цикл задачи ----------
+
+    def on_queued(self, job_id: int, jtype: str, model: str = ""):
+        if job_id not in self._queued and job_id not in self._running:
+            self._queued[job_id] = _Entry(jtype, model or "", time.time())
+
+    def on_started(self, job_id: int):
+        e = self._queued.pop(job_id, None)
+        if e is None:
+            return
+        e.started_at = time.time()
+        self._running[job_id] = e
+
+    def on_finished(self, job_id: int, *, record: bool = True):
+        e = self._running.pop(job_id, None) or self._queued.pop(job_id, None)
+        if e is None or e.started_at is None or not record or not e.timed:
+            return
+        self._observe(e.jtype, e.model, time.time() - e.started_at)
+
+    def sync(self, rows: List[Tuple[int, str, str, str]], tracked: Iterable[int], capacity: Optional[int] = None):
+        """
+        Сверка с БД, когда задачи выполняют другие процессы (python -m app.worker):
+        их on_started / on_finished сюда не доходят. rows — (id, type, model, status)
+        для активных задач и для всех из tracked — tracked_ids(), снятых до SELECT.
+        """
+        before = set(tracked)
+        for job_id, jtype, model, status in rows:
+            known = job_id in self._queued or job_id in self._running
+            if job_id in before and not known:
+                # свой воркер закрыл задачу, пока шёл запрос, — не воскрешаем
+                continue
+            if status == "queued":
+                self.on_queued(job_id, jtype, model)
+            elif status == "running":
+                if not known:
+                    self.on_queued(job_id, jtype, model)
+                    self.on_started(job_id)
+                    self._running[job_id].timed = False
+                else:
+                    self.on_started(job_id)
+            else:
+                self.on_finished(job_id, record=status == "done")
+        if capacity:
+            self.concurrency = max(1, capacity)
+
+    def tracked_ids(self) -> List[int]:
+        return [*self._queued, *self._running]
+
+    # ---------- оценки ----------
+
+    def _running_backlog(self, now: float) -> float:
+        total = 0.0
+        for e in self._running.values():
+            elapsed = now - (e.started_at or now)
+            total += max(0.0, self.expected_duration(e.jtype, e.model) - elapsed)
+        return total
+
+    def estimated_wait(self) -> float:
+        """
+        Сколько ждать задаче, поставленной прямо сейчас (в конец очереди).
+        """
+        now = time.time()
+        backlog = self._running_backlog(now)
+        backlog += sum(self.expected_duration(e.jtype, e.model) for e in self._queued.values())
+        return backlog / self.concurrency
+
+    def estimate(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Позиция и ожидаемый старт для задачи, которая ещё в очереди.
+        O(длина очереди) — очередь ограничена ADMISSION_MAX_QUEUE.
+        """
+        if job_id in self._running:
+            e = self._running[job_id]
+            return {
+                "position": 0,
+                "estimated_start_at": int(e.started_at or time.time()),
+                "estimated_wait_s": 0,
+            }
+        if job_id not in self._queued:
+            return None
+
+        now = time.time()
+        ahead = self._running_backlog(now)
+        position = 0
+        for jid, e in self._queued.items():
+            if jid == job_id:
+                break
+            ahead += self.expected_duration(e.jtype, e.model)
+            position += 1
+        wait = ahead / self.concurrency
+        return {
+            "position": position + 1,
+            "estimated_start_at": int(now + wait),
+            "estimated_wait_s": int(wait),
+        }
+
+    def admit(self, jtype: str, model: str = ""):
+        depth = len(self._queued)
+        wait = self.estimated_wait()
+        if depth >= ADMISSION_MAX_QUEUE or wait > ADMISSION_MAX_WAIT_SEC:
+            self.rejected += 1
+            raise Overloaded(wait, depth)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "concurrency": self.concurrency,
+            "estimated_wait_s": int(self.estimated_wait()),
+            "rejected": self.rejected,
+            "avg_duration_s": {f"{t}:{m}" if m else t: round(v, 1) for (t, m), v in self._avg.items()},
+        }
+
+
+admission = AdmissionController()
@@ -1,18 +1,33 @@
 import os
-import json
 import asyncio
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 
+from app import jobctx, tracing
+from app.jsonx import dumps_safe
+from app.tracing import span
+
 APIFREE_BASE_URL = (os.getenv("APIFREE_BASE_URL") or "https://api.apifree.ai").rstrip("/")
 APIFREE_MODEL_BASE_URL = (os.getenv("APIFREE_MODEL_BASE_URL") or "https://api.skycoding.ai").rstrip("/")
 APIFREE_API_KEY = (os.getenv("APIFREE_API_KEY") or "").strip()
 HTTP_TIMEOUT = float(os.getenv("APIFREE_HTTP_TIMEOUT_SEC") or "180")
+CANCEL_TIMEOUT_S = 10.0
 
 class APIFreeError(RuntimeError):
     pass
 
+class APIFreeTimeout(APIFreeError):
+    """
+    Задача у провайдера не закончилась за отведённое время. task_id сохраняется,
+    поллинг можно продолжить через apifree_poll_task.
+    """
+
+    def __init__(self, task_id: str, last_status: Optional[Dict[str, Any]] = None):
+        super().__init__(f"task timeout, task_id={task_id}")
+        self.task_id = task_id
+        self.last_status = last_status
+
 def _auth_headers() -> Dict[str, str]:
     if not APIFREE_API_KEY:
         return {}
@@ -25,15 +40,46 @@ def _clean_endpoint_id(endpoint_id: str) -> str:
             s = s[len(prefix):]
     return s
 
-async def _request_json(method: str, url: str, payload: Optional[Dict[str, Any]] = None, timeout_s: float = HTTP_TIMEOUT):
-    async with httpx.AsyncClient(timeout=timeout_s, headers=_auth_headers()) as client:
-        r = await client.request(method, url, json=payload)
+# общий пул соединений (keep-alive к APIFree), создаётся лениво, закрывается в lifecycle
+_client: Optional[httpx.AsyncClient] = None
 
-    txt = r.text or ""
-    try:
-        data = r.json() if txt else {}
-    except Exception:
-        data = {"raw": txt}
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            headers=_auth_headers(),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+async def aclose_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+async def _request_json(
+    method: str,
+    url: str,
+    payload: Optional[Dict[str, Any]] = None,
+    timeout_s: float = HTTP_TIMEOUT,
+    clamp: bool = True,
+):
+    # таймаут запроса не больше остатка бюджета задачи (если есть)
+    if clamp:
+        timeout_s = jobctx.clamp_timeout(timeout_s)
+    with span("apifree.request", **{"http.method": method}) as sp:
+        if tracing.sampled():
+            sp["url.path"] = httpx.URL(url).path
+        r = await get_client().request(method, url, json=payload, timeout=timeout_s)
+        sp["http.status_code"] = r.status_code
+
+        txt = r.text or ""
+        try:
+            data = r.json() if txt else {}
+        except Exception:
+            data = {"raw": txt}
     return r.status_code, data, txt
 
 async def list_models() -> Dict[str, Any]:
@@ -43,11 +89,11 @@ async def list_models() -> Dict[str, Any]:
         raise APIFreeError(f"list_models failed [{code}]: {txt}")
     return data
 
-async def chat_completion(model: str, message: str) -> Dict[str, Any]:
+async def chat_completion(model: str, message: str = "", messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
     url = f"{APIFREE_BASE_URL}/v1/chat/completions"
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": message}]
+        "messages": messages or [{"role": "user", "content": message}]
     }
     code, data, txt = await _request_json("POST", url, payload)
     if code < 200 or code >= 300:
@@ -103,6 +149,131 @@ async def model_poll(task_id: str, timeout_s: float = 30.0) -> Optional[Dict[str
 
     return None
 
+async def model_cancel(task_id: str, timeout_s: float = CANCEL_TIMEOUT_S) -> bool:
+    """
+    Отмена задачи у провайдера. Поддерживается не везде — пробуем типичные пути,
+    True если кто-то ответил 2xx.
+    """
+    candidates = [
+        f"{APIFREE_MODEL_BASE_URL}/v1/task/{task_id}/cancel",
+        f"{APIFREE_MODEL_BASE_URL}/v1/tasks/{task_id}/cancel",
+        f"{APIFREE_MODEL_BASE_URL}/v1/job/{task_id}/cancel",
+    ]
+
+    for url in candidates:
+        code, data, txt = await _request_json("POST", url, {}, timeout_s=timeout_s, clamp=False)
+        if 200 <= code < 300:
+            return True
+    return False
+
+def _extract_progress(data: Dict[str, Any], status: str) -> Optional[Dict[str, Any]]:
+    """
+    Прогресс из ответа поллинга: процент и/или позиция в очереди провайдера.
+    progress бывает долей (0.45), бывает процентом (45) — приводим к процентам.
+    """
+    src = data
+    inner = data.get("data") or data.get("result")
+    if isinstance(inner, dict):
+        src = {**inner, **data}
+
+    percent = None
+    for k in ("progress", "percent", "percentage"):
+        v = src.get(k)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            percent = v * 100.0 if isinstance(v, float) and v <= 1.0 else float(v)
+            break
+
+    position = None
+    for k in ("queue_position", "position"):
+        v = src.get(k)
+        if isinstance(v, int) and not isinstance(v, bool):
+            position = v
+            break
+
+    if percent is None and position is None and not status:
+        return None
+    return {
+        "percent": int(max(0.0, min(100.0, percent))) if percent is not None else None,
+        "queue_position": position,
+        "stage": status or None,
+    }
+
+async def _report_progress(data: Dict[str, Any], status: str):
+    ctx = jobctx.current()
+    if ctx is None or ctx.on_progress is None:
+        return
+    progress = _extract_progress(data, status)
+    if progress is None:
+        return
+    try:
+        await ctx.on_progress(progress)
+    except Exception:
+        pass
+
+async def _poll_until_done(task_id: str, deadline: float, poll_every_s: float) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    last_status = None
+
+    attempt = 0
+    try:
+        while loop.time() < deadline:
+            attempt += 1
+            try:
+                with span("apifree.poll", task_id=task_id, attempt=attempt) as sp:
+                    sdata = await model_poll(task_id)
+                    sp["status"] = str((sdata or {}).get("status") or (sdata or {}).get("state") or "")
+            except httpx.TimeoutException as e:
+                # таймаут запроса урезан до остатка бюджета: на дедлайне это timeout задачи
+                # (task_id сохранён, /resume продолжит), раньше — просто пробуем ещё раз
+                if loop.time() >= deadline - 1.0:
+                    raise APIFreeTimeout(task_id, last_status) from e
+                sdata = None
+            if sdata:
+                last_status = sdata
+                status = str(sdata.get("status") or sdata.get("state") or "").lower().strip()
+
+                if status in ("succeeded", "success", "done", "completed", "finished"):
+                    return sdata
+                if status in ("failed", "error", "canceled", "cancelled"):
+                    raise APIFreeError(f"task failed: {dumps_safe(sdata)[:4000]}")
+                if _is_final(sdata):
+                    return sdata
+                await _report_progress(sdata, status)
+
+            await asyncio.sleep(max(0.0, min(poll_every_s, deadline - loop.time())))
+    except asyncio.CancelledError:
+        # отменил пользователь — отменяем и у провайдера. drain / жёсткий дедлайн задачу
+        # провайдера не трогают: после рестарта или /resume поллинг продолжится по task_id
+        ctx = jobctx.current()
+        if ctx is not None and ctx.cancel_upstream:
+            try:
+                await asyncio.wait_for(model_cancel(task_id), timeout=CANCEL_TIMEOUT_S)
+            except Exception:
+                pass
+        raise
+
+    raise APIFreeTimeout(task_id, last_status)
+
+def _poll_deadline(max_wait_s: float) -> float:
+    # берём меньшее из max_wait_s и остатка бюджета задачи
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait_s
+    ctx = jobctx.current()
+    if ctx is not None and ctx.deadline is not None:
+        deadline = min(deadline, ctx.deadline)
+    return deadline
+
+async def apifree_poll_task(
+    task_id: str,
+    *,
+    max_wait_s: float = 1800.0,
+    poll_every_s: float = 3.0,
+) -> Dict[str, Any]:
+    """
+    Поллинг уже созданной задачи (продолжение после timeout / рестарта, без повторной оплаты).
+    """
+    return await _poll_until_done(task_id, _poll_deadline(max_wait_s), poll_every_s)
+
 async def apifree_post_with_optional_polling(
     endpoint_id: str,
     payload: Dict[str, Any],
@@ -120,22 +291,12 @@ async def apifree_post_with_optional_polling(
     if not task_id:
         return data
 
-    deadline = asyncio.get_event_loop().time() + max_wait_s
-    last_status = None
-
-    while asyncio.get_event_loop().time() < deadline:
-        sdata = await model_poll(task_id)
-        if sdata:
-            last_status = sdata
-            status = str(sdata.get("status") or sdata.get("state") or "").lower().strip()
-
-            if status in ("succeeded", "success", "done", "completed", "finished"):
-                return sdata
-            if status in ("failed", "error", "canceled", "cancelled"):
-                raise APIFreeError(f"task failed: {json.dumps(sdata, ensure_ascii=False)[:4000]}")
-            if _is_final(sdata):
-                return sdata
-
-        await asyncio.sleep(poll_every_s)
+    # запоминаем task_id на задаче — по нему можно продолжить поллинг после timeout
+    ctx = jobctx.current()
+    if ctx is not None and ctx.on_task_id is not None:
+        try:
+            await ctx.on_task_id(task_id)
+        except Exception:
+            pass
 
-    return {"status": "timeout", "task_id": task_id, "last_status": last_status}
+    return await _poll_until_done(task_id, _poll_deadline(max_wait_s), poll_every_s)
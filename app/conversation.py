@@ -0,0 +1,222 @@
+"""
+Память чата на пользователя: последние сообщения + краткое содержание старых.
+
+SQLite — источник правды, перед ним LRU активных диалогов в памяти.
+Задачи чата могут выполнять разные процессы (python -m app.worker), поэтому
+кэш read-through: перед использованием сверяем версию (MAX(id), COUNT(*)) с БД —
+один запрос по индексу, — и перечитываем историю, если её поменял другой процесс.
+История ограничена по строкам и по токенам; когда лимит превышен, старшую
+половину сворачиваем в summary (через ту же chat-модель) или просто отбрасываем.
+Сжатие идёт фоном уже после доставки ответа (compact_later): пользователь
+не ждёт лишний запрос к модели.
+"""
+import os
+import asyncio
+import contextvars
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiosqlite
+
+from app.db import DB_PATH, log
+
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES") or "20")
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS") or "3000")
+CHAT_SUMMARIZE = os.getenv("CHAT_SUMMARIZE", "1") == "1"
+CHAT_LRU_SIZE = int(os.getenv("CHAT_LRU_SIZE") or "500")
+
+SUMMARY_ROLE = "summary"
+SUMMARY_PROMPT = (
+    "Сожми переписку ниже в краткое содержание (до 120 слов) на языке переписки: "
+    "факты о пользователе, о чём договорились, открытые вопросы. Только содержание, без вступлений."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # грубо: ~3 символа на токен (кириллица дороже латиницы) + служебные токены сообщения
+    return len(text or "") // 3 + 4
+
+
+Message = Dict[str, Any]  # {"id", "role", "content", "tokens"}
+
+
+class ConversationStore:
+    def __init__(self, lru_size: int = CHAT_LRU_SIZE):
+        self.lru_size = lru_size
+        self._lru: "OrderedDict[int, List[Message]]" = OrderedDict()
+        self._compacting: Dict[int, asyncio.Task] = {}
+
+    # ---------- кэш ----------
+
+    def _remember(self, tg_id: int, msgs: List[Message]):
+        self._lru[tg_id] = msgs
+        self._lru.move_to_end(tg_id)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    @staticmethod
+    def _version(msgs: List[Message]) -> tuple:
+        return (max((m["id"] for m in msgs), default=None), len(msgs))
+
+    async def get(self, tg_id: int) -> List[Message]:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cur = await db.execute(
+                "SELECT MAX(id), COUNT(*) FROM chat_messages WHERE tg_id=?",
+                (int(tg_id),),
+            )
+            version = tuple(await cur.fetchone())
+            await cur.close()
+
+            msgs = self._lru.get(tg_id)
+            # id растут монотонно: любая запись, сжатие или reset (в т.ч. чужим процессом) меняют версию
+            if msgs is not None and self._version(msgs) == version:
+                self._lru.move_to_end(tg_id)
+                return msgs
+
+            cur = await db.execute(
+                "SELECT id, role, content, tokens FROM chat_messages WHERE tg_id=? ORDER BY id",
+                (int(tg_id),),
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+        msgs = [{"id": r[0], "role": r[1], "content": r[2], "tokens": r[3]} for r in rows]
+        self._remember(tg_id, msgs)
+        return msgs
+
+    # ---------- чтение ----------
+
+    def build_messages(self, history: List[Message], prompt: str, max_tokens: int = CHAT_HISTORY_MAX_TOKENS) -> List[Dict[str, str]]:
+        """
+        messages для chat/completions: summary (если есть) + самые свежие реплики,
+        которые влезают в бюджет, + текущий вопрос.
+        """
+        budget = max_tokens - estimate_tokens(prompt)
+        summary = next((m for m in history if m["role"] == SUMMARY_ROLE), None)
+        if summary is not None:
+            budget -= summary["tokens"]
+
+        tail: List[Dict[str, str]] = []
+        for m in reversed(history):
+            if m["role"] == SUMMARY_ROLE:
+                continue
+            if m["tokens"] > budget:
+                break
+            budget -= m["tokens"]
+            tail.append({"role": m["role"], "content": m["content"]})
+        tail.reverse()
+
+        messages: List[Dict[str, str]] = []
+        if summary is not None:
+            messages.append({"role": "system", "content": f"Краткое содержание предыдущего разговора: {summary['content']}"})
+        messages.extend(tail)
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    # ---------- запись ----------
+
+    async def append(self, tg_id: int, pairs: List[tuple]):
+        history = list(await self.get(tg_id))
+        async with aiosqlite.connect(DB_PATH) as db:
+            for role, content in pairs:
+                tokens = estimate_tokens(content)
+                cur = await db.execute(
+                    "INSERT INTO chat_messages(tg_id, role, content, tokens) VALUES (?,?,?,?)",
+                    (int(tg_id), role, content, tokens),
+                )
+                history.append({"id": cur.lastrowid, "role": role, "content": content, "tokens": tokens})
+                await cur.close()
+            await db.commit()
+        self._remember(tg_id, history)
+
+    # ---------- сжатие ----------
+
+    @staticmethod
+    def _over_limit(history: List[Message]) -> bool:
+        turns = sum(1 for m in history if m["role"] != SUMMARY_ROLE)
+        return turns > CHAT_HISTORY_MAX_MESSAGES or sum(m["tokens"] for m in history) > CHAT_HISTORY_MAX_TOKENS
+
+    def compact_later(
+        self,
+        tg_id: int,
+        summarize: Optional[Callable[[List[Dict[str, str]]], Awaitable[str]]] = None,
+    ):
+        """
+        Сжать историю фоном, если она вышла за лимиты. Зовётся после доставки ответа.
+        """
+        history = self._lru.get(tg_id)
+        if history is None or not self._over_limit(history) or tg_id in self._compacting:
+            return
+        # пустой контекст: без дедлайна и трейса задачи, которая уже закончилась
+        task = asyncio.get_running_loop().create_task(self.compact(tg_id, summarize), context=contextvars.Context())
+        self._compacting[tg_id] = task
+        task.add_done_callback(lambda _t, k=tg_id: self._compacting.pop(k, None))
+
+    async def compact(self, tg_id: int, summarize=None):
+        try:
+            history = await self._compact(tg_id, list(await self.get(tg_id)), summarize)
+            # если пока сжимали, пришли новые реплики — get() увидит другую версию и перечитает
+            self._remember(tg_id, history)
+        except Exception as e:
+            await log("error", "chat compaction failed", {"tg_id": tg_id, "err": str(e)})
+
+    async def aclose(self, timeout_s: float = 5.0):
+        """
+        На остановке: дать фоновым сжатиям доделаться (история в БД и так целая).
+        """
+        tasks = list(self._compacting.values())
+        if not tasks:
+            return
+        _, late = await asyncio.wait(tasks, timeout=timeout_s)
+        for t in late:
+            t.cancel()
+
+    async def _compact(self, tg_id: int, history: List[Message], summarize) -> List[Message]:
+        if not self._over_limit(history):
+            return history
+        turns = [m for m in history if m["role"] != SUMMARY_ROLE]
+
+        # сворачиваем старшую половину за раз, чтобы не делать это на каждом сообщении
+        cut = max(2, len(turns) // 2)
+        old, keep = turns[:cut], turns[cut:]
+        if not old:
+            return history
+        summary = next((m for m in history if m["role"] == SUMMARY_ROLE), None)
+
+        new_summary = None
+        if summarize is not None and CHAT_SUMMARIZE:
+            src = []
+            if summary is not None:
+                src.append({"role": "system", "content": f"Прошлое содержание: {summary['content']}"})
+            src.extend({"role": m["role"], "content": m["content"]} for m in old)
+            try:
+                new_summary = (await summarize(src) or "").strip() or None
+            except Exception as e:
+                await log("error", "chat summarize failed", {"tg_id": tg_id, "err": str(e)})
+
+        drop_ids = [m["id"] for m in old]
+        if new_summary is not None and summary is not None:
+            drop_ids.append(summary["id"])
+
+        async with aiosqlite.connect(DB_PATH) as db:
+            marks = ",".join("?" for _ in drop_ids)
+            await db.execute(f"DELETE FROM chat_messages WHERE id IN ({marks})", drop_ids)
+            if new_summary is not None:
+                tokens = estimate_tokens(new_summary)
+                cur = await db.execute(
+                    "INSERT INTO chat_messages(tg_id, role, content, tokens) VALUES (?,?,?,?)",
+                    (int(tg_id), SUMMARY_ROLE, new_summary, tokens),
+                )
+                summary = {"id": cur.lastrowid, "role": SUMMARY_ROLE, "content": new_summary, "tokens": tokens}
+                await cur.close()
+            await db.commit()
+
+        return ([summary] if summary is not None else []) + keep
+
+    async def reset(self, tg_id: int):
+        self._lru.pop(tg_id, None)
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("DELETE FROM chat_messages WHERE tg_id=?", (int(tg_id),))
+            await db.commit()
+
+
+conversations = ConversationStore()
@@ -1,7 +1,9 @@
 import os
-import json
+import asyncio
 import aiosqlite
-from typing import Any, Dict, Optional, Tuple, Set
+from typing import Any, Dict, List, Optional, Tuple, Set
+
+from app.jsonx import dumps_safe
 
 DB_PATH = os.getenv("DB_PATH", "/var/data/app.db")
 
@@ -22,31 +24,93 @@ async def db_fetchone(db: aiosqlite.Connection, sql: str, params: Tuple[Any, ...
     return row
 
 
+_LOGS_DDL = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    level TEXT NOT NULL,
+    message TEXT NOT NULL,
+    meta_json TEXT,
+    created_at TEXT DEFAULT (datetime('now'))
+)
+"""
+
+# Буфер логов: пока работает flusher (его запускает lifecycle), log() только
+# кладёт строку в память, а запись в SQLite идёт пачкой. Без flusher'а — пишем сразу.
+LOG_FLUSH_EVERY_SEC = float(os.getenv("LOG_FLUSH_EVERY_SEC") or "1.0")
+LOG_BUFFER_MAX = 1000
+
+_log_buffer: List[Tuple[str, str, str]] = []
+_log_flusher: Optional[asyncio.Task] = None
+_log_stop: Optional[asyncio.Event] = None
+
+
+async def _write_logs(rows: List[Tuple[str, str, str]]):
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(_LOGS_DDL)
+        await db.executemany(
+            "INSERT INTO logs(level, message, meta_json) VALUES (?,?,?)",
+            rows,
+        )
+        await db.commit()
+
+
 async def log(level: str, message: str, meta: Optional[Dict[str, Any]] = None):
     """
     Безопасный логгер в SQLite. Никогда не валит приложение.
     """
     try:
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("""
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                level TEXT NOT NULL,
-                message TEXT NOT NULL,
-                meta_json TEXT,
-                created_at TEXT DEFAULT (datetime('now'))
-            )
-            """)
-            await db.execute(
-                "INSERT INTO logs(level, message, meta_json) VALUES (?,?,?)",
-                (level, message, json.dumps(meta or {}, ensure_ascii=False)),
-            )
-            await db.commit()
+        row = (level, message, dumps_safe(meta or {}))
+        if _log_flusher is not None and not _log_flusher.done():
+            if len(_log_buffer) < LOG_BUFFER_MAX:
+                _log_buffer.append(row)
+            return
+        await _write_logs([row])
+    except Exception:
+        pass
+
+
+async def flush_logs():
+    """
+    Сбросить буфер логов в SQLite (вызывается периодически и при shutdown).
+    """
+    if not _log_buffer:
+        return
+    rows = _log_buffer[:]
+    del _log_buffer[:]
+    try:
+        await _write_logs(rows)
     except Exception:
         pass
 
 
+async def _log_flush_loop(stop: asyncio.Event):
+    # останавливаем событием, а не cancel(): отмена посреди aiosqlite.connect
+    # оставляет поток соединения, и процесс не может завершиться
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=LOG_FLUSH_EVERY_SEC)
+        except asyncio.TimeoutError:
+            pass
+        await flush_logs()
+
+
+def start_log_flusher():
+    global _log_flusher, _log_stop
+    if _log_flusher is None or _log_flusher.done():
+        _log_stop = asyncio.Event()
+        _log_flusher = asyncio.create_task(_log_flush_loop(_log_stop))
+
+
+async def stop_log_flusher():
+    global _log_flusher
+    task, _log_flusher = _log_flusher, None
+    if task is not None:
+        _log_stop.set()
+        await task
+    await flush_logs()
+
+
 # ---------- init / migrations ----------
 
 async def init_db():
@@ -76,9 +140,44 @@ async def init_db():
             payload_json TEXT,
             result_json TEXT,
             error TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT,
+            credits_charged INTEGER NOT NULL DEFAULT 0,
+            upstream_task_id TEXT,
+            trace_id TEXT,
+            progress_json TEXT,
+            status_message_id INTEGER,
+            worker_id TEXT,
+            heartbeat_at TEXT,
+            requeued_at TEXT
+        )
+        """)
+
+        # CHAT MEMORY (история диалога на пользователя, см. app/conversation.py)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tg_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            tokens INTEGER NOT NULL DEFAULT 0,
             created_at TEXT DEFAULT (datetime('now'))
         )
         """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_tg ON chat_messages(tg_id, id)")
+
+        # WORKERS (процессы-воркеры и их heartbeat, см. app/worker.py)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS workers (
+            id TEXT PRIMARY KEY,
+            pid INTEGER,
+            host TEXT,
+            concurrency INTEGER NOT NULL DEFAULT 1,
+            running INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT DEFAULT (datetime('now')),
+            heartbeat_at TEXT
+        )
+        """)
 
         # на всякий: если таблица была создана раньше без колонок — добавим миграциями
         # users migrations
@@ -108,6 +207,27 @@ async def init_db():
             await db.execute("ALTER TABLE jobs ADD COLUMN error TEXT;")
         if "created_at" not in jcols:
             await db.execute("ALTER TABLE jobs ADD COLUMN created_at TEXT DEFAULT (datetime('now'));")
+        if "updated_at" not in jcols:
+            # ALTER TABLE не умеет DEFAULT с datetime(), воркер сам проставляет значение
+            await db.execute("ALTER TABLE jobs ADD COLUMN updated_at TEXT;")
+        if "credits_charged" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN credits_charged INTEGER NOT NULL DEFAULT 0;")
+        if "upstream_task_id" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN upstream_task_id TEXT;")
+        if "trace_id" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN trace_id TEXT;")
+        if "progress_json" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN progress_json TEXT;")
+        if "status_message_id" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN status_message_id INTEGER;")
+        if "worker_id" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT;")
+        if "heartbeat_at" not in jcols:
+            await db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at TEXT;")
+        if "requeued_at" not in jcols:
+            # когда задачу последний раз вернули в очередь (resume / drain / упавший воркер)
+            await db.execute("ALTER TABLE jobs ADD COLUMN requeued_at TEXT;")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
 
         await db.commit()
 
@@ -135,6 +255,7 @@ async def get_or_create_user(tg_id: int):
 async def consume_credit(tg_id: int) -> bool:
     """
     Пока делаем 'безлимит', чтобы ничего не блокировало.
+    Расход всё равно учитываем, чтобы refund_credit был честным.
     """
     async with aiosqlite.connect(DB_PATH) as db:
         row = await db_fetchone(
@@ -147,5 +268,249 @@ async def consume_credit(tg_id: int) -> bool:
                 "INSERT INTO users(tg_id, free_credits, pro_credits) VALUES (?,?,?)",
                 (int(tg_id), 999999, 0),
             )
-            await db.commit()
+        await db.execute(
+            "UPDATE users SET free_credits = MAX(free_credits - 1, 0) WHERE tg_id=?",
+            (int(tg_id),),
+        )
+        await db.commit()
         return True
+
+
+async def refund_credit(tg_id: int):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE users SET free_credits = free_credits + 1 WHERE tg_id=?",
+            (int(tg_id),),
+        )
+        await db.commit()
+
+
+async def cancel_job(job_id: int, tg_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Переводит задачу в 'cancelled', если она ещё queued/running и принадлежит tg_id.
+    Возвращает {"tg_id", "prev_status", "credits_charged"} или None, если отменять нечего.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        row = await db_fetchone(
+            db,
+            "SELECT tg_id, status, credits_charged FROM jobs WHERE id=?",
+            (int(job_id),),
+        )
+        if not row or row[1] not in ("queued", "running"):
+            return None
+        if int(row[0] or 0) != int(tg_id):
+            return None
+
+        cur = await db.execute(
+            "UPDATE jobs SET status='cancelled', credits_charged=0, updated_at=datetime('now') "
+            "WHERE id=? AND status IN ('queued', 'running')",
+            (int(job_id),),
+        )
+        changed = cur.rowcount
+        await cur.close()
+        await db.commit()
+        if not changed:
+            return None
+
+    return {"tg_id": int(row[0] or 0), "prev_status": row[1], "credits_charged": int(row[2] or 0)}
+
+
+async def set_status_message(job_id: int, message_id: Optional[int]):
+    """
+    Запоминаем сообщение «Принято…» — воркер дописывает в него прогресс.
+    """
+    if not message_id:
+        return
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("UPDATE jobs SET status_message_id=? WHERE id=?", (int(message_id), int(job_id)))
+        await db.commit()
+
+
+async def latest_job_id(tg_id: int, statuses: Tuple[str, ...] = ("queued", "running")) -> Optional[int]:
+    marks = ",".join("?" for _ in statuses)
+    async with aiosqlite.connect(DB_PATH) as db:
+        row = await db_fetchone(
+            db,
+            f"SELECT id FROM jobs WHERE tg_id=? AND status IN ({marks}) ORDER BY id DESC LIMIT 1",
+            (int(tg_id), *statuses),
+        )
+    return int(row[0]) if row else None
+
+
+async def resume_job(job_id: int, tg_id: int) -> Optional[Dict[str, Any]]:
+    """
+    timeout -> queued, если у провайдера осталась задача (upstream_task_id) и задача принадлежит tg_id,
+    чтобы воркер продолжил её поллинг. Возвращает {"type", "model"} или None.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        row = await db_fetchone(
+            db,
+            "SELECT tg_id, type, model, status, upstream_task_id FROM jobs WHERE id=?",
+            (int(job_id),),
+        )
+        if not row or row[3] != "timeout" or not row[4]:
+            return None
+        if int(row[0] or 0) != int(tg_id):
+            return None
+
+        cur = await db.execute(
+            "UPDATE jobs SET status='queued', error=NULL, requeued_at=datetime('now'), updated_at=datetime('now') WHERE id=? AND status='timeout'",
+            (int(job_id),),
+        )
+        changed = cur.rowcount
+        await cur.close()
+        await db.commit()
+        if not changed:
+            return None
+
+    return {"type": row[1] or "", "model": row[2] or ""}
+
+
+def _ago(seconds: float) -> str:
+    # модификатор для datetime('now', ?)
+    return f"-{int(seconds)} seconds"
+
+
+async def recover_pending_jobs(stale_s: float) -> List[Tuple[int, str, str]]:
+    """
+    После рестарта: задачи, которые были в очереди или прерваны посреди
+    выполнения, возвращаем в 'queued' и отдаём (id, type, model) для повторной постановки.
+    'running' с живым heartbeat не трогаем — их выполняет другой процесс-воркер.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE jobs SET status='queued', worker_id=NULL, requeued_at=datetime('now'), updated_at=datetime('now') "
+            "WHERE status='running' AND (heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))",
+            (_ago(stale_s),),
+        )
+        await db.commit()
+        cur = await db.execute("SELECT id, type, model FROM jobs WHERE status='queued' ORDER BY id")
+        rows = await cur.fetchall()
+        await cur.close()
+    return [(int(r[0]), r[1] or "", r[2] or "") for r in rows]
+
+
+async def active_job_payloads() -> List[str]:
+    """
+    payload_json задач, которые ещё могут понадобиться провайдеру (для чистки загрузок).
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "SELECT payload_json FROM jobs WHERE status IN ('queued', 'running') AND payload_json LIKE '%/uploads/%'"
+        )
+        rows = await cur.fetchall()
+        await cur.close()
+    return [r[0] for r in rows]
+
+
+# ---------- workers (несколько процессов на одной БД) ----------
+
+async def claim_next_job(worker_id: str) -> Optional[int]:
+    """
+    queued -> running за этим воркером, самая старая задача (FIFO). None — очередь пуста.
+    UPDATE ... WHERE status='queued' атомарен, так что одну задачу забирает ровно один процесс.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        for _ in range(5):
+            row = await db_fetchone(db, "SELECT id FROM jobs WHERE status='queued' ORDER BY id LIMIT 1")
+            if not row:
+                return None
+            cur = await db.execute(
+                "UPDATE jobs SET status='running', worker_id=?, heartbeat_at=datetime('now'), updated_at=datetime('now') "
+                "WHERE id=? AND status='queued'",
+                (worker_id, int(row[0])),
+            )
+            changed = cur.rowcount
+            await cur.close()
+            await db.commit()
+            if changed:
+                return int(row[0])
+            # задачу забрал другой процесс — берём следующую
+    return None
+
+
+async def worker_heartbeat(worker_id: str, info: Dict[str, Any], job_ids: List[int]) -> List[int]:
+    """
+    Обновляет heartbeat воркера и его задач. Возвращает id задач из job_ids,
+    которые тем временем отменили (через API другого процесса).
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "INSERT INTO workers(id, pid, host, concurrency, running, heartbeat_at) VALUES (?,?,?,?,?,datetime('now')) "
+            "ON CONFLICT(id) DO UPDATE SET running=excluded.running, concurrency=excluded.concurrency, heartbeat_at=excluded.heartbeat_at",
+            (worker_id, info.get("pid"), info.get("host"), int(info.get("concurrency") or 1), len(job_ids)),
+        )
+        cancelled: List[int] = []
+        if job_ids:
+            marks = ",".join("?" for _ in job_ids)
+            await db.execute(
+                f"UPDATE jobs SET heartbeat_at=datetime('now') WHERE worker_id=? AND id IN ({marks})",
+                (worker_id, *job_ids),
+            )
+            cur = await db.execute(f"SELECT id FROM jobs WHERE status='cancelled' AND id IN ({marks})", tuple(job_ids))
+            cancelled = [int(r[0]) for r in await cur.fetchall()]
+            await cur.close()
+        await db.commit()
+    return cancelled
+
+
+async def reclaim_stale_jobs(stale_s: float) -> List[int]:
+    """
+    Задачи, чей воркер перестал слать heartbeat (упал / убит), — обратно в 'queued'.
+    Если у провайдера уже есть upstream_task_id, следующий воркер продолжит поллинг.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "SELECT id FROM jobs WHERE status='running' AND heartbeat_at < datetime('now', ?)",
+            (_ago(stale_s),),
+        )
+        stale = [int(r[0]) for r in await cur.fetchall()]
+        await cur.close()
+        ids = []
+        for job_id in stale:
+            # одну и ту же задачу могут подбирать несколько воркеров — возвращаем те, что вернули мы
+            cur = await db.execute(
+                "UPDATE jobs SET status='queued', worker_id=NULL, requeued_at=datetime('now'), updated_at=datetime('now') "
+                "WHERE id=? AND status='running' AND heartbeat_at < datetime('now', ?)",
+                (job_id, _ago(stale_s)),
+            )
+            if cur.rowcount:
+                ids.append(job_id)
+            await cur.close()
+        await db.execute("DELETE FROM workers WHERE heartbeat_at < datetime('now', ?)", (_ago(stale_s),))
+        await db.commit()
+    return ids
+
+
+async def unregister_worker(worker_id: str):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("DELETE FROM workers WHERE id=?", (worker_id,))
+        await db.commit()
+
+
+async def list_workers(stale_s: float) -> List[Dict[str, Any]]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "SELECT id, pid, host, concurrency, running, started_at, heartbeat_at FROM workers "
+            "WHERE heartbeat_at >= datetime('now', ?) ORDER BY started_at",
+            (_ago(stale_s),),
+        )
+        rows = await cur.fetchall()
+        await cur.close()
+    keys = ("id", "pid", "host", "concurrency", "running", "started_at", "heartbeat_at")
+    return [dict(zip(keys, r)) for r in rows]
+
+
+async def jobs_for_admission(tracked: List[int]) -> List[Tuple[int, str, str, str]]:
+    """
+    (id, type, model, status) для активных задач и для тех, что трекер ещё считает активными.
+    """
+    marks = ",".join("?" for _ in tracked) or "NULL"
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            f"SELECT id, type, model, status FROM jobs WHERE status IN ('queued', 'running') OR id IN ({marks}) ORDER BY id",
+            tuple(tracked),
+        )
+        rows = await cur.fetchall()
+        await cur.close()
+    return [(int(r[0]), r[1] or "", r[2] or "", r[3] or "") for r in rows]
@@ -0,0 +1,108 @@
+"""
+Контекст выполняемой задачи (contextvar): дедлайн и колбэки (task_id, прогресс).
+Воркер выставляет его на время задачи, а apifree_client / telegram читают,
+не протаскивая параметры через все сервисы.
+"""
+import os
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# бюджет на задачу целиком (submit + поллинг + доставка), сек
+DEFAULT_JOB_DEADLINE_SEC = {
+    "chat": 180.0,
+    "image": 600.0,
+    "video": 1800.0,
+    "music": 1200.0,
+}
+
+
+def _parse_model_deadlines(raw: str) -> Dict[str, float]:
+    """
+    MODEL_DEADLINES="klingai/kling-v2.6/pro/image-to-video=2400,google/nano-banana-pro=300"
+    """
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        model, _, sec = part.strip().rpartition("=")
+        if not model:
+            continue
+        try:
+            out[model.strip()] = float(sec)
+        except ValueError:
+            pass
+    return out
+
+
+MODEL_DEADLINES = _parse_model_deadlines(os.getenv("MODEL_DEADLINES") or "")
+
+
+def job_deadline_s(jtype: str, model: str = "") -> float:
+    if model and model in MODEL_DEADLINES:
+        return MODEL_DEADLINES[model]
+    env = os.getenv(f"JOB_DEADLINE_SEC_{(jtype or '').upper()}")
+    if env:
+        try:
+            return float(env)
+        except ValueError:
+            pass
+    return DEFAULT_JOB_DEADLINE_SEC.get(jtype, 600.0)
+
+
+@dataclass
+class JobContext:
+    job_id: int
+    deadline: Optional[float] = None  # loop.time(), когда бюджет кончается
+    on_task_id: Optional[Callable[[str], Awaitable[None]]] = None
+    on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+    # True только при явной отмене пользователем: тогда отменяем задачу и у провайдера.
+    # drain / дедлайн тоже рвут корутину, но задачу провайдера оставляют — её доделают после рестарта / /resume
+    cancel_upstream: bool = False
+
+
+_current: ContextVar[Optional[JobContext]] = ContextVar("job_context", default=None)
+# job_id -> контекст выполняющейся задачи (чтобы пометить отмену снаружи)
+_active: Dict[int, JobContext] = {}
+
+
+def current() -> Optional[JobContext]:
+    return _current.get()
+
+
+@contextmanager
+def job_context(ctx: JobContext):
+    token = _current.set(ctx)
+    _active[ctx.job_id] = ctx
+    try:
+        yield ctx
+    finally:
+        if _active.get(ctx.job_id) is ctx:
+            del _active[ctx.job_id]
+        _current.reset(token)
+
+
+def mark_user_cancelled(job_id: int):
+    ctx = _active.get(job_id)
+    if ctx is not None:
+        ctx.cancel_upstream = True
+
+
+def remaining() -> Optional[float]:
+    """
+    Сколько секунд осталось у текущей задачи (None — дедлайна нет).
+    """
+    ctx = _current.get()
+    if ctx is None or ctx.deadline is None:
+        return None
+    return ctx.deadline - asyncio.get_running_loop().time()
+
+
+def clamp_timeout(timeout_s: float, floor: float = 1.0) -> float:
+    """
+    Таймаут отдельного HTTP-запроса, урезанный до остатка бюджета задачи.
+    """
+    left = remaining()
+    if left is None:
+        return timeout_s
+    return max(floor, min(timeout_s, left))
@@ -0,0 +1,60 @@
+"""
+Единый JSON-слой: orjson если установлен, иначе stdlib json.
+Используется в БД-хелперах, воркере и как default_response_class в FastAPI.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    Компактный UTF-8 JSON (без пробелов, кириллица как есть).
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTS)
+        except TypeError:
+            # то, что orjson не умеет (int > 64 бит и т.п.) — отдаём stdlib
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def dumps_safe(obj: Any) -> str:
+    """
+    Как dumps, но никогда не падает: несериализуемое заворачиваем в {"raw": str(obj)}.
+    """
+    try:
+        return dumps(obj)
+    except Exception:
+        return dumps({"raw": str(obj)})
+
+
+def loads(s: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse через dumps_bytes. FastAPI сначала прогоняет ответ через
+    jsonable_encoder, так что сюда приходят уже простые типы.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
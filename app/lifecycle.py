@@ -0,0 +1,237 @@
+import os
+import signal
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from app.db import (
+    init_db, log, recover_pending_jobs, start_log_flusher, stop_log_flusher,
+    unregister_worker, list_workers, jobs_for_admission, active_job_payloads,
+)
+from app.queue import enqueue
+from app.admission import admission
+from app.worker import Worker, _transition, WORKER_CONCURRENCY, WORKER_STALE_SEC
+from app import apifree_client, telegram, uploads
+from app.conversation import conversations
+from app.profiling import loop_monitor, LOOP_MONITOR_ENABLED
+
+# сколько ждём завершения текущих генераций при SIGTERM (Render даёт ~30 сек)
+SHUTDOWN_DRAIN_SEC = float(os.getenv("SHUTDOWN_DRAIN_SEC") or "25")
+WORKER_RESTART_BACKOFF_SEC = 1.0
+WORKER_RESTART_BACKOFF_MAX_SEC = 30.0
+WORKER_STOP_TIMEOUT_SEC = 5.0
+# 0 — процесс API только принимает задачи, выполняют их отдельные `python -m app.worker`
+RUN_WORKER_IN_PROCESS = os.getenv("RUN_WORKER_IN_PROCESS", "1") == "1"
+# как часто API сверяет оценки очереди с БД (задачи выполняют другие процессы)
+ADMISSION_SYNC_SEC = float(os.getenv("ADMISSION_SYNC_SEC") or "5")
+
+
+class WorkerSupervisor:
+    """
+    Ровно один воркер на процесс (с WORKER_CONCURRENCY слотами). Если run() упал — перезапускаем с backoff.
+    drain(): перестаём брать задачи, ждём текущие до дедлайна, остальные
+    отменяем и возвращаем в 'queued' (подберутся после рестарта).
+    """
+
+    def __init__(self, use_queue: bool = True):
+        self.use_queue = use_queue
+        self.worker: Optional[Worker] = None
+        self._task: Optional[asyncio.Task] = None
+        self.restarts = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        backoff = WORKER_RESTART_BACKOFF_SEC
+        self.worker = Worker(use_queue=self.use_queue)
+        while not self.worker.stopping.is_set():
+            try:
+                await self.worker.run()
+                backoff = WORKER_RESTART_BACKOFF_SEC
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.restarts += 1
+                await log("error", "worker crashed, restarting", {"err": str(e), "restarts": self.restarts})
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, WORKER_RESTART_BACKOFF_MAX_SEC)
+
+    def cancel_job(self, job_id: int) -> bool:
+        if self.worker is None:
+            return False
+        return self.worker.cancel_job(job_id)
+
+    async def drain(self, deadline_s: float = SHUTDOWN_DRAIN_SEC):
+        if self.worker is None:
+            return
+        self.worker.stop()
+
+        # run() выходит сам (не отменяем его посреди запроса к БД); после этого inflight уже не растёт
+        if self._task is not None:
+            await asyncio.wait({self._task}, timeout=WORKER_STOP_TIMEOUT_SEC)
+
+        pending = list(self.worker.inflight.items())
+        if pending:
+            await log("info", "draining jobs", {"jobs": [j for j, _ in pending], "deadline_s": deadline_s})
+            await asyncio.wait([t for _, t in pending], timeout=deadline_s)
+
+        # не успели — отменяем и чекпоинтим обратно в очередь
+        for job_id, task in pending:
+            if task.done():
+                continue
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            try:
+                # только если задачу тем временем не отменили
+                await _transition(job_id, self.worker.worker_id, "queued", error=None, worker_id=None)
+            except Exception:
+                pass
+            await log("info", "job checkpointed on shutdown", {"job_id": job_id})
+
+        if self._task is not None and not self._task.done():
+            # завис в backoff после падения — тут отмена безопасна
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+
+        await self.worker.aclose()
+        try:
+            await unregister_worker(self.worker.worker_id)
+        except Exception:
+            pass
+
+
+class AppState:
+    """
+    Общее состояние процесса: принимаем ли новые задачи + супервизор воркера.
+    """
+
+    def __init__(self):
+        self.accepting = False
+        self.supervisor = WorkerSupervisor()
+
+
+state = AppState()
+
+
+async def _stopped(stop: asyncio.Event, seconds: float) -> bool:
+    # пауза фонового цикла; True — пора выходить. Циклы выходят сами, без cancel():
+    # отмена посреди aiosqlite.connect оставляет поток соединения и вешает остановку процесса
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def _admission_sync_loop(stop: asyncio.Event):
+    # задачи, выполняемые другими процессами, меняют статус только в БД
+    while not await _stopped(stop, ADMISSION_SYNC_SEC):
+        try:
+            tracked = admission.tracked_ids()
+            rows = await jobs_for_admission(tracked)
+            workers = await list_workers(WORKER_STALE_SEC)
+            admission.sync(rows, tracked, capacity=sum(int(w["concurrency"] or 0) for w in workers))
+        except Exception as e:
+            await log("error", "admission sync failed", {"err": str(e)})
+
+
+async def _upload_cleanup_loop(stop: asyncio.Event):
+    # загрузки нужны провайдеру только пока задача не ушла к нему; старые и ничьи — удаляем
+    while True:
+        try:
+            keep = uploads.referenced_names(await active_job_payloads())
+            removed = await asyncio.to_thread(uploads.cleanup_uploads, keep)
+            if removed:
+                await log("info", "uploads cleaned", {"removed": removed})
+        except Exception as e:
+            await log("error", "upload cleanup failed", {"err": str(e)})
+        if await _stopped(stop, uploads.UPLOAD_CLEANUP_INTERVAL_SEC):
+            return
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await init_db()
+    start_log_flusher()
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+    # всё, что было в очереди / выполнялось до рестарта — обратно в очередь
+    try:
+        recovered = await recover_pending_jobs(WORKER_STALE_SEC)
+    except Exception as e:
+        recovered = []
+        await log("error", "recover pending jobs failed", {"err": str(e)})
+    for job_id, jtype, model in recovered:
+        admission.on_queued(job_id, jtype, model)
+        if RUN_WORKER_IN_PROCESS:
+            await enqueue(job_id)
+
+    if RUN_WORKER_IN_PROCESS:
+        admission.concurrency = max(1, WORKER_CONCURRENCY)
+        state.supervisor.start()
+    stop_background = asyncio.Event()
+    background = [
+        asyncio.create_task(_admission_sync_loop(stop_background)),
+        asyncio.create_task(_upload_cleanup_loop(stop_background)),
+    ]
+    state.accepting = True
+    await log("info", "lifecycle started", {"recovered_jobs": len(recovered), "worker_in_process": RUN_WORKER_IN_PROCESS})
+
+    try:
+        yield
+    finally:
+        state.accepting = False
+        stop_background.set()
+        _, late = await asyncio.wait(background, timeout=WORKER_STOP_TIMEOUT_SEC)
+        for t in late:
+            t.cancel()
+        await state.supervisor.drain()
+        await conversations.aclose()
+        await apifree_client.aclose_client()
+        await telegram.aclose_client()
+        await loop_monitor.stop()
+        await log("info", "lifecycle stopped")
+        await stop_log_flusher()
+
+
+async def run_worker_process():
+    """
+    Отдельный процесс-воркер (python -m app.worker): без HTTP, только задачи из БД.
+    SIGTERM / SIGINT — drain, как при остановке API.
+    """
+    await init_db()
+    start_log_flusher()
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+    # в этот процесс enqueue никто не делает — только БД
+    supervisor = WorkerSupervisor(use_queue=False)
+    supervisor.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await supervisor.drain()
+        await conversations.aclose()
+        await apifree_client.aclose_client()
+        await telegram.aclose_client()
+        await loop_monitor.stop()
+        await log("info", "worker process stopped")
+        await stop_log_flusher()
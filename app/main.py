@@ -1,50 +1,137 @@
 import os
-import json
+import hmac
 import asyncio
+import math
+import httpx
 import aiosqlite
+from contextlib import asynccontextmanager
 from typing import Any, Dict, Optional
 
 from fastapi import FastAPI, HTTPException, Request, Body
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-
-import httpx
+from starlette.datastructures import UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, Response, RedirectResponse, FileResponse
 
-from app.db import init_db, DB_PATH, log, get_or_create_user, consume_credit
+from app.db import DB_PATH, log, get_or_create_user, consume_credit, refund_credit, cancel_job, latest_job_id, resume_job, set_status_message, list_workers
 from app.queue import enqueue
-from app.models import get_models_catalog
-from app.worker import worker_loop
-from app.telegram import tg_send_message
+from app.models import models_catalog, CATALOG_CLIENT_MAX_AGE_SEC
+from app.telegram import tg_send_message, tg_call, tg_file_url
+from app import telegram
+from app import uploads
+from app.lifecycle import lifespan, state, RUN_WORKER_IN_PROCESS
+from app.worker import WORKER_STALE_SEC
+from app.ratelimit import limiter, RateLimited
+from app.admission import admission, Overloaded, ADMISSION_MAX_WAIT_SEC
+from app.jsonx import FastJSONResponse, dumps, loads
+from app import tracing
+from app.tracing import span
+from app.profiling import loop_monitor
+from app.conversation import conversations
+from app.static_assets import build_assets, pick_encoding
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
-
-WEBAPP_DIR = os.path.join(os.path.dirname(__file__), "webapp")
-
-app = FastAPI(title="Guurenko Mini App Backend", version="1.0.0")
-
-# ВАЖНО: не падаем если папки нет, а корректно
-if os.path.isdir(WEBAPP_DIR):
-    app.mount("/webapp", StaticFiles(directory=WEBAPP_DIR, html=True), name="webapp")
-
-@app.on_event("startup")
-async def startup():
-    await init_db()
-    asyncio.create_task(worker_loop())
-    await log("info", "startup ok", {"db": DB_PATH})
-
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+@asynccontextmanager
+async def app_lifespan(app: FastAPI):
+    # БД, один воркер под супервизором, общие http-клиенты, drain при SIGTERM
+    async with lifespan(app):
+        models_catalog.schedule_refresh()
+        await _set_webhook()
+        await log("info", "startup ok", {"db": DB_PATH})
+        yield
+
+app = FastAPI(
+    title="Guurenko Mini App Backend",
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=app_lifespan,
+)
+
+# Mini App: хэшированные имена + gzip/br готовятся один раз при импорте.
+# ВАЖНО: не падаем если папки нет — просто пустой словарь
+WEBAPP_ASSETS = build_assets()
+
+async def _set_webhook():
     # Авто setWebhook (можно отключить переменной)
     if os.getenv("AUTO_SET_WEBHOOK", "1") == "1" and BOT_TOKEN:
         try:
             base = PUBLIC_BASE_URL or ""
             if base:
                 url = f"{base}/telegram/webhook/hook"
-                async with httpx.AsyncClient(timeout=20) as client:
-                    await client.get(f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook", params={"url": url})
+                await tg_call("setWebhook", {"url": url})
                 await log("info", "setWebhook", {"url": url})
         except Exception as e:
             await log("error", "setWebhook failed", {"err": str(e)})
 
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    retry_after = max(1, math.ceil(exc.retry_after))
+    return FastJSONResponse(
+        status_code=429,
+        content={"detail": "Слишком часто, попробуй чуть позже", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def _require_admin(request: Request):
+    # /debug/* доступны только с ADMIN_TOKEN; без него — будто их нет
+    token = request.headers.get("x-admin-token") or request.query_params.get("token") or ""
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(404, "not found")
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    retry_after = int(min(600, max(30, exc.estimated_wait_s - ADMISSION_MAX_WAIT_SEC)))
+    return FastJSONResponse(
+        status_code=503,
+        content={
+            "detail": "Очередь переполнена, попробуй позже",
+            "estimated_wait_s": int(exc.estimated_wait_s),
+            "queue_depth": exc.queue_depth,
+        },
+        headers={"Retry-After": str(retry_after)},
+    )
+
+@app.get("/debug/queue", include_in_schema=False)
+async def debug_queue(request: Request):
+    _require_admin(request)
+    return {**admission.stats(), "workers": await list_workers(WORKER_STALE_SEC)}
+
+@app.get("/debug/ratelimit", include_in_schema=False)
+async def debug_ratelimit(request: Request):
+    _require_admin(request)
+    return limiter.stats()
+
+@app.get("/debug/jobs/{job_id}/trace", include_in_schema=False)
+async def debug_job_trace(job_id: int, request: Request, format: str = "otlp"):
+    _require_admin(request)
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT trace_id FROM jobs WHERE id=?", (int(job_id),))
+        row = await cur.fetchone()
+        await cur.close()
+    if not row:
+        raise HTTPException(404, "job not found")
+    if not row[0]:
+        raise HTTPException(404, "job was not sampled")
+    if format == "summary":
+        return {"job_id": int(job_id), "trace_id": row[0], "spans": tracing.summarize_trace(row[0])}
+    return tracing.export_trace(row[0])
+
+@app.get("/debug/loop", include_in_schema=False)
+async def debug_loop(request: Request):
+    _require_admin(request)
+    return loop_monitor.stats()
+
+@app.get("/debug/profile", include_in_schema=False)
+async def debug_profile(request: Request, seconds: float = 10.0):
+    # сэмплер живёт в отдельном потоке и смотрит на стек потока event loop
+    _require_admin(request)
+    res = await asyncio.to_thread(loop_monitor.sample_profile, seconds)
+    if res is None:
+        raise HTTPException(409, "profiler already running")
+    header = f"# samples={res['samples']} seconds={res.get('seconds', 0)} (folded stacks, flamegraph.pl / speedscope)\n"
+    return Response(content=header + res["folded"], media_type="text/plain; charset=utf-8")
+
 @app.get("/health")
 async def health():
     return "OK"
@@ -54,29 +141,140 @@ async def root():
     # редирект на miniapp
     return HTMLResponse('<meta http-equiv="refresh" content="0; url=/webapp/" />')
 
+# ---------- Mini App static ----------
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
+
+@app.get("/webapp", include_in_schema=False)
+async def webapp_redirect():
+    return RedirectResponse("/webapp/", status_code=301)
+
+@app.api_route("/webapp/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def webapp_static(path: str, request: Request):
+    asset = WEBAPP_ASSETS.get(path)
+    if asset is None:
+        raise HTTPException(404, "not found")
+
+    body = asset.raw
+    etag = asset.etag
+    enc = pick_encoding(request.headers.get("accept-encoding", ""), asset)
+    if enc == "br":
+        body = asset.br
+    elif enc == "gzip":
+        body = asset.gz
+    if enc:
+        # у каждого варианта свой ETag, иначе кэши могут перепутать представления
+        etag = etag[:-1] + f'-{enc}"'
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": asset.cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    if enc:
+        headers["Content-Encoding"] = enc
+
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(body))
+        return Response(status_code=200, headers=headers, media_type=asset.content_type)
+    return Response(content=body, headers=headers, media_type=asset.content_type)
+
 # ---------- Mini App API ----------
 
 @app.get("/api/models")
-async def api_models():
-    return get_models_catalog()
+async def api_models(request: Request):
+    # готовые байты + ETag из кэша, без сборки dict на каждый запрос
+    body, etag = models_catalog.snapshot()
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CATALOG_CLIENT_MAX_AGE_SEC}, stale-while-revalidate=600",
+    }
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/api/me")
 async def api_me(tg_id: int):
     u = await get_or_create_user(int(tg_id))
     return u
 
-async def _create_job(tg_id: int, jtype: str, model: str, prompt: str, payload: Optional[Dict[str, Any]] = None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "INSERT INTO jobs(tg_id, type, status, model, prompt, payload_json) VALUES (?,?,?,?,?,?)",
-            (int(tg_id), jtype, "queued", model, prompt, json.dumps(payload or {}, ensure_ascii=False)),
-        )
-        await db.commit()
-        job_id = cur.lastrowid
-        await cur.close()
-    await enqueue(job_id)
+async def _create_job(
+    tg_id: int,
+    jtype: str,
+    model: str,
+    prompt: str,
+    payload: Optional[Dict[str, Any]] = None,
+    charge: bool = False,
+    limit: bool = True,
+):
+    if not state.accepting:
+        # идёт деплой / остановка — задачу не принимаем, чтобы не потерять
+        raise HTTPException(503, "Сервис перезапускается, попробуй через минуту", headers={"Retry-After": "30"})
+
+    if limit:
+        # до списания кредита: отказ по лимиту ничего не стоит
+        limiter.check(tg_id, jtype)
+
+    # очередь и так на ADMISSION_MAX_WAIT_SEC вперёд — лучше честно отказать сразу
+    admission.admit(jtype, model)
+
+    if charge:
+        ok = await consume_credit(tg_id)
+        if not ok:
+            raise HTTPException(402, "Недостаточно кредитов")
+
+    # трейс задачи: продолжаем трейс вебхука, если он есть, иначе начинаем новый
+    trace_id = tracing.job_trace_id()
+    with tracing.trace(trace_id), span("db.create_job", type=jtype, model=model):
+        async with aiosqlite.connect(DB_PATH) as db:
+            cur = await db.execute(
+                "INSERT INTO jobs(tg_id, type, status, model, prompt, payload_json, credits_charged, trace_id) VALUES (?,?,?,?,?,?,?,?)",
+                (int(tg_id), jtype, "queued", model, prompt, dumps(payload or {}), 1 if charge else 0, trace_id),
+            )
+            await db.commit()
+            job_id = cur.lastrowid
+            await cur.close()
+    admission.on_queued(job_id, jtype, model)
+    if RUN_WORKER_IN_PROCESS:
+        await enqueue(job_id)
     return job_id
 
+def _queued_response(job_id: int) -> Dict[str, Any]:
+    return {"job_id": job_id, "status": "queued", "queue": admission.estimate(job_id)}
+
+def _queue_note(job_id: int) -> str:
+    q = admission.estimate(job_id)
+    if not q or q["position"] <= 1:
+        return ""
+    return f"\nВ очереди: {q['position']}, старт примерно через {max(1, q['estimated_wait_s'] // 60)} мин."
+
+async def _ack(chat_id: int, job_id: int, what: str):
+    # «Принято…» — в это же сообщение воркер потом дописывает прогресс
+    mid = await tg_send_message(chat_id, f"✅ Принято. {what}… (job {job_id})" + _queue_note(job_id))
+    await set_status_message(job_id, mid)
+
+async def _cancel_job(job_id: int, tg_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Отмена: статус -> cancelled, рвём корутину (и поллинг провайдера), возвращаем кредит.
+    """
+    info = await cancel_job(job_id, tg_id)
+    if info is None:
+        return None
+    admission.on_finished(job_id, record=False)
+    state.supervisor.cancel_job(job_id)
+    if info["credits_charged"]:
+        await refund_credit(info["tg_id"])
+    await log("info", "job cancelled", {"job_id": job_id, "prev_status": info["prev_status"]})
+    return info
+
 @app.post("/api/chat")
 async def api_chat(body: Dict[str, Any] = Body(default={})):
     tg_id = int(body.get("tg_id") or 0)
@@ -88,15 +286,95 @@ async def api_chat(body: Dict[str, Any] = Body(default={})):
     if not message:
         raise HTTPException(400, "message пустой")
 
-    ok = await consume_credit(tg_id)
-    if not ok:
-        raise HTTPException(402, "Недостаточно кредитов")
-
-    job_id = await _create_job(tg_id, "chat", model, message)
-    return {"job_id": job_id, "status": "queued"}
+    job_id = await _create_job(tg_id, "chat", model, message, charge=True)
+    return _queued_response(job_id)
+
+# ---------- uploads (image-to-video / референсы) ----------
+
+def _safe_err(e: Exception) -> Dict[str, Any]:
+    # текст ошибок httpx содержит URL, а в URL файлов Telegram — токен бота
+    status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+    return {"err": type(e).__name__, "status": status}
+
+def _base_url(request: Optional[Request] = None) -> str:
+    if PUBLIC_BASE_URL:
+        return PUBLIC_BASE_URL
+    return str(request.base_url).rstrip("/") if request is not None else ""
+
+def _with_image_ref(request: Request, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    upload_id (из /api/upload) или готовый image_url -> payload с image_url для провайдера.
+    """
+    upload_id = (body.get("upload_id") or "").strip()
+    image_url = (body.get("image_url") or "").strip()
+    if upload_id:
+        if not uploads.is_valid_name(upload_id) or not os.path.exists(uploads.upload_path(upload_id)):
+            raise HTTPException(400, "upload_id не найден")
+        image_url = uploads.public_url(_base_url(request), upload_id)
+    if not image_url:
+        return None
+    if not image_url.startswith("http"):
+        raise HTTPException(400, "image_url должен быть http(s) ссылкой")
+    return {"image_url": image_url}
+
+@app.post("/api/upload")
+async def api_upload(request: Request):
+    # всё проверяем до чтения тела: иначе Starlette сначала целиком спулит multipart на диск
+    length = request.headers.get("content-length") or ""
+    if not length.isdigit():
+        raise HTTPException(411, "нужен Content-Length")
+    if int(length) > uploads.MAX_UPLOAD_BYTES + uploads.MULTIPART_OVERHEAD:
+        raise HTTPException(413, f"файл больше {uploads.MAX_UPLOAD_BYTES // (1024 * 1024)} МБ")
+    if not uploads.has_free_space():
+        raise HTTPException(507, "Хранилище заполнено, попробуй позже")
+
+    tg_id = int(request.query_params.get("tg_id") or 0)
+    if tg_id:
+        limiter.check(tg_id, "upload")
+
+    form = await request.form(max_files=1, max_fields=5)
+    try:
+        if not tg_id:
+            # старые клиенты присылают tg_id полем формы
+            try:
+                tg_id = int(form.get("tg_id") or 0)
+            except ValueError:
+                tg_id = 0
+            if not tg_id:
+                raise HTTPException(400, "tg_id обязателен")
+            limiter.check(tg_id, "upload")
+
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(400, "file обязателен")
+        # multipart уже лежит в SpooledTemporaryFile (в памяти максимум ~1 МБ), дальше копируем чанками
+        try:
+            name, size = await uploads.save_upload(file.file, file.content_type)
+        except uploads.UploadError as e:
+            raise HTTPException(400, str(e))
+    finally:
+        await form.close()
+    return {"upload_id": name, "url": uploads.public_url(_base_url(request), name), "size": size}
+
+@app.get("/uploads/{name}", include_in_schema=False)
+async def get_upload(name: str):
+    path = uploads.upload_path(name)
+    if not uploads.is_valid_name(name) or not os.path.exists(path):
+        raise HTTPException(404, "not found")
+    # имя = sha256 содержимого, файл не меняется никогда
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.post("/api/chat/reset")
+async def api_chat_reset(body: Dict[str, Any] = Body(default={})):
+    # начать диалог заново: стираем историю и summary
+    tg_id = int(body.get("tg_id") or 0)
+    if not tg_id:
+        raise HTTPException(400, "tg_id обязателен")
+    await conversations.reset(tg_id)
+    return {"ok": True}
 
 @app.post("/api/image/submit")
-async def api_image_submit(body: Dict[str, Any] = Body(default={})):
+async def api_image_submit(request: Request, body: Dict[str, Any] = Body(default={})):
     tg_id = int(body.get("tg_id") or 0)
     prompt = (body.get("prompt") or "").strip()
     model = (body.get("model") or "").strip()
@@ -106,15 +384,12 @@ async def api_image_submit(body: Dict[str, Any] = Body(default={})):
     if not prompt:
         raise HTTPException(400, "prompt пустой")
 
-    ok = await consume_credit(tg_id)
-    if not ok:
-        raise HTTPException(402, "Недостаточно кредитов")
-
-    job_id = await _create_job(tg_id, "image", model, prompt)
-    return {"job_id": job_id, "status": "queued"}
+    payload = _with_image_ref(request, body)
+    job_id = await _create_job(tg_id, "image", model, prompt, payload=payload, charge=True)
+    return _queued_response(job_id)
 
 @app.post("/api/video/submit")
-async def api_video_submit(body: Dict[str, Any] = Body(default={})):
+async def api_video_submit(request: Request, body: Dict[str, Any] = Body(default={})):
     tg_id = int(body.get("tg_id") or 0)
     prompt = (body.get("prompt") or "").strip()
     model = (body.get("model") or "").strip()
@@ -124,12 +399,9 @@ async def api_video_submit(body: Dict[str, Any] = Body(default={})):
     if not prompt:
         raise HTTPException(400, "prompt пустой")
 
-    ok = await consume_credit(tg_id)
-    if not ok:
-        raise HTTPException(402, "Недостаточно кредитов")
-
-    job_id = await _create_job(tg_id, "video", model, prompt)
-    return {"job_id": job_id, "status": "queued"}
+    payload = _with_image_ref(request, body)
+    job_id = await _create_job(tg_id, "video", model, prompt, payload=payload, charge=True)
+    return _queued_response(job_id)
 
 @app.post("/api/music/submit")
 async def api_music_submit(body: Dict[str, Any] = Body(default={})):
@@ -143,18 +415,14 @@ async def api_music_submit(body: Dict[str, Any] = Body(default={})):
     if not lyrics:
         raise HTTPException(400, "lyrics пустой")
 
-    ok = await consume_credit(tg_id)
-    if not ok:
-        raise HTTPException(402, "Недостаточно кредитов")
-
-    job_id = await _create_job(tg_id, "music", model, lyrics, payload={"lyrics": lyrics, "style": style})
-    return {"job_id": job_id, "status": "queued"}
+    job_id = await _create_job(tg_id, "music", model, lyrics, payload={"lyrics": lyrics, "style": style}, charge=True)
+    return _queued_response(job_id)
 
 @app.get("/api/job/{job_id}")
 async def api_job(job_id: int):
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
-            "SELECT id, tg_id, type, status, model, prompt, result_json, error FROM jobs WHERE id=?",
+            "SELECT id, tg_id, type, status, model, prompt, result_json, error, progress_json FROM jobs WHERE id=?",
             (int(job_id),),
         )
         row = await cur.fetchone()
@@ -166,10 +434,17 @@ async def api_job(job_id: int):
     result = None
     if row[6]:
         try:
-            result = json.loads(row[6])
+            result = loads(row[6])
         except Exception:
             result = {"raw": row[6]}
 
+    progress = None
+    if row[8] and row[3] in ("queued", "running"):
+        try:
+            progress = loads(row[8])
+        except Exception:
+            progress = None
+
     return {
         "id": row[0],
         "tg_id": row[1],
@@ -178,24 +453,65 @@ async def api_job(job_id: int):
         "model": row[4],
         "prompt": row[5],
         "result": result,
+        "media_urls": (result.get("media_urls") or []) if isinstance(result, dict) else [],
         "error": row[7],
+        "queue": admission.estimate(row[0]) if row[3] in ("queued", "running") else None,
+        "progress": progress,
     }
 
+@app.post("/api/job/{job_id}/cancel")
+async def api_job_cancel(job_id: int, body: Dict[str, Any] = Body(default={})):
+    tg_id = int(body.get("tg_id") or 0)
+    if not tg_id:
+        raise HTTPException(400, "tg_id обязателен")
+    info = await _cancel_job(int(job_id), tg_id)
+    if info is None:
+        raise HTTPException(409, "Задачу нельзя отменить (уже завершена или не найдена)")
+    return {"job_id": int(job_id), "status": "cancelled"}
+
+async def _resume_job(job_id: int, tg_id: int) -> bool:
+    info = await resume_job(job_id, tg_id)
+    if info is None:
+        return False
+    admission.on_queued(job_id, info["type"], info["model"])
+    if RUN_WORKER_IN_PROCESS:
+        await enqueue(job_id)
+    return True
+
+@app.post("/api/job/{job_id}/resume")
+async def api_job_resume(job_id: int, body: Dict[str, Any] = Body(default={})):
+    # продолжить поллинг задачи, упавшей по timeout (повторно не оплачивается)
+    tg_id = int(body.get("tg_id") or 0)
+    if not tg_id:
+        raise HTTPException(400, "tg_id обязателен")
+    if not await _resume_job(int(job_id), tg_id):
+        raise HTTPException(409, "Задачу нельзя продолжить")
+    return _queued_response(int(job_id))
+
 # ---------- Telegram webhook ----------
-@app.on_event("startup")
-async def startup():
-    asyncio.create_task(worker_loop())
 @app.post("/telegram/webhook/hook")
 async def telegram_webhook_hook(req: Request):
     update = await req.json()
     message = (update.get("message") or {})
-    text = (message.get("text") or "").strip()
-    chat = message.get("chat") or {}
-    chat_id = chat.get("id")
+    chat_id = (message.get("chat") or {}).get("id")
 
     if not chat_id:
         return {"ok": True}
 
+    try:
+        with tracing.trace(tracing.new_trace_id()), span("telegram.webhook", chat_id=int(chat_id)):
+            return await _handle_bot_message(req, message, int(chat_id))
+    except RateLimited as e:
+        # боту отвечаем сообщением, а Telegram — 200, иначе он будет ретраить апдейт
+        await tg_send_message(int(chat_id), f"⏳ Слишком часто. Попробуй через {max(1, math.ceil(e.retry_after))} сек.")
+        return {"ok": True}
+    except Overloaded as e:
+        await tg_send_message(int(chat_id), f"😮‍💨 Очередь переполнена (~{int(e.estimated_wait_s // 60)} мин ожидания). Попробуй позже.")
+        return {"ok": True}
+
+async def _handle_bot_message(req: Request, message: Dict[str, Any], chat_id: int):
+    text = (message.get("text") or "").strip()
+
     # /start
     if text.startswith("/start"):
         miniapp_url = (PUBLIC_BASE_URL or "").rstrip("/") + "/webapp/"
@@ -210,34 +526,95 @@ async def telegram_webhook_hook(req: Request):
                 ]]
             }
         }
-        if BOT_TOKEN:
-            async with httpx.AsyncClient(timeout=30) as client:
-                await client.post(f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage", json=payload)
+        await tg_call("sendMessage", payload)
+        return {"ok": True}
+
+    # /cancel [job_id] — без id отменяем последнюю активную задачу
+    if text.startswith("/cancel"):
+        arg = text.replace("/cancel", "", 1).strip()
+        jid = int(arg) if arg.isdigit() else await latest_job_id(int(chat_id))
+        info = await _cancel_job(jid, int(chat_id)) if jid else None
+        if info is None:
+            await tg_send_message(int(chat_id), "Нечего отменять 🤷")
+        else:
+            refund = ", кредит возвращён" if info["credits_charged"] else ""
+            await tg_send_message(int(chat_id), f"⛔️ Задача {jid} отменена{refund}.")
+        return {"ok": True}
+
+    # /reset — забыть историю чата
+    if text.startswith("/reset") or text.startswith("/new"):
+        await conversations.reset(int(chat_id))
+        await tg_send_message(int(chat_id), "🧹 История чата очищена, начинаем заново.")
+        return {"ok": True}
+
+    # /resume [job_id] — продолжить ждать задачу после timeout
+    if text.startswith("/resume"):
+        arg = text.replace("/resume", "", 1).strip()
+        jid = int(arg) if arg.isdigit() else await latest_job_id(int(chat_id), ("timeout",))
+        if jid and await _resume_job(jid, int(chat_id)):
+            await tg_send_message(int(chat_id), f"🔄 Снова жду результат задачи {jid}…" + _queue_note(jid))
+        else:
+            await tg_send_message(int(chat_id), "Нечего продолжать 🤷")
+        return {"ok": True}
+
+    # фото с подписью -> image-to-video (подпись = промпт, можно с /video)
+    photos = message.get("photo") or []
+    if photos:
+        prompt = (message.get("caption") or "").strip()
+        if prompt.startswith("/video"):
+            prompt = prompt.replace("/video", "", 1).strip()
+        if not prompt:
+            await tg_send_message(int(chat_id), "Пришли фото с подписью — что должно происходить в видео 🎬")
+            return {"ok": True}
+
+        # лимит проверяем до скачивания фото
+        limiter.check(int(chat_id), "video")
+
+        # самое большое превью — последнее в списке
+        try:
+            file_url = await tg_file_url(photos[-1].get("file_id") or "")
+        except Exception as e:
+            # иначе webhook отдаст 500 и Telegram будет повторять апдейт
+            await log("error", "telegram getFile failed", _safe_err(e))
+            file_url = None
+        if not file_url:
+            await tg_send_message(int(chat_id), "Не удалось получить фото, попробуй ещё раз")
+            return {"ok": True}
+        try:
+            name, _ = await uploads.save_from_url(telegram.get_client(), file_url, "image/jpeg")
+        except Exception as e:
+            await log("error", "telegram photo download failed", _safe_err(e))
+            await tg_send_message(int(chat_id), "Не удалось сохранить фото, попробуй ещё раз")
+            return {"ok": True}
+
+        image_url = uploads.public_url(_base_url(req), name)
+        jid = await _create_job(int(chat_id), "video", "", prompt, payload={"image_url": image_url}, limit=False)
+        await _ack(int(chat_id), jid, "Оживляю фото")
         return {"ok": True}
 
     # быстрые команды в чате
     if text.startswith("/image "):
         prompt = text.replace("/image", "", 1).strip()
         jid = await _create_job(int(chat_id), "image", "", prompt)
-        await tg_send_message(int(chat_id), f"✅ Принято. Генерирую изображение… (job {jid})")
+        await _ack(int(chat_id), jid, "Генерирую изображение")
         return {"ok": True}
 
     if text.startswith("/video "):
         prompt = text.replace("/video", "", 1).strip()
         jid = await _create_job(int(chat_id), "video", "", prompt)
-        await tg_send_message(int(chat_id), f"✅ Принято. Генерирую видео… (job {jid})")
+        await _ack(int(chat_id), jid, "Генерирую видео")
         return {"ok": True}
 
     if text.startswith("/music "):
         lyrics = text.replace("/music", "", 1).strip()
         jid = await _create_job(int(chat_id), "music", "", lyrics, payload={"lyrics": lyrics})
-        await tg_send_message(int(chat_id), f"✅ Принято. Генерирую музыку… (job {jid})")
+        await _ack(int(chat_id), jid, "Генерирую музыку")
         return {"ok": True}
 
     if text.startswith("/chat "):
         msg = text.replace("/chat", "", 1).strip()
         jid = await _create_job(int(chat_id), "chat", "", msg)
-        await tg_send_message(int(chat_id), f"✅ Принято. Думаю… (job {jid})")
+        await _ack(int(chat_id), jid, "Думаю")
         return {"ok": True}
 
     return {"ok": True}
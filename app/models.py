@@ -1,11 +1,26 @@
+import os
+import time
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.jsonx import dumps_bytes
+
 DEFAULT_CHAT_MODEL = "openai/gpt-5.2"
 GROK_CHAT_MODEL = "xai/grok-4"
 DEFAULT_IMAGE_MODEL = "google/nano-banana-pro"
 DEFAULT_VIDEO_MODEL = "klingai/kling-v2.6/pro/image-to-video"
 DEFAULT_MUSIC_MODEL = "mureka-ai/mureka-v8/generate-song"
+
+# сколько секунд каталог считается свежим; после — отдаём старый и обновляем в фоне
+CATALOG_TTL_SEC = float(os.getenv("MODELS_CATALOG_TTL_SEC") or "600")
+# сколько клиент (Mini App) может держать ответ у себя без перепроверки
+CATALOG_CLIENT_MAX_AGE_SEC = int(os.getenv("MODELS_CATALOG_CLIENT_MAX_AGE_SEC") or "60")
+
+
 def get_models_catalog():
     """
-    Каталог моделей для Mini App
+    Каталог моделей для Mini App (статический, он же fallback)
     """
 
     return {
@@ -46,3 +61,124 @@ def get_models_catalog():
             }
         ]
     }
+
+
+# ---------- live catalog (list_models + cache) ----------
+
+def _guess_kind(item: Dict[str, Any]) -> Optional[str]:
+    """
+    Определяем раздел каталога по ответу /v1/models.
+    Сначала явные поля, потом эвристика по id.
+    """
+    for k in ("type", "category", "modality", "task"):
+        v = str(item.get(k) or "").lower()
+        if not v:
+            continue
+        if "video" in v:
+            return "video"
+        if "image" in v:
+            return "image"
+        if "music" in v or "audio" in v or "song" in v:
+            return "music"
+        if "chat" in v or "text" in v or "llm" in v:
+            return "chat"
+
+    mid = str(item.get("id") or "").lower()
+    if "video" in mid:
+        return "video"
+    if "song" in mid or "music" in mid:
+        return "music"
+    if "image" in mid or "banana" in mid:
+        return "image"
+    return None
+
+
+def _catalog_from_list_models(data: Any) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Сливаем ответ list_models со статическим каталогом.
+    Статические модели всегда остаются (и идут первыми), чтобы дефолты не пропали.
+    """
+    catalog = get_models_catalog()
+    seen = {m["id"] for items in catalog.values() for m in items}
+
+    items = data.get("data") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return catalog
+
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        mid = str(it.get("id") or "").strip()
+        if not mid or mid in seen:
+            continue
+        kind = _guess_kind(it)
+        if kind not in catalog:
+            continue
+        catalog[kind].append({
+            "id": mid,
+            "name": it.get("name") or mid.split("/")[-1],
+            "provider": it.get("provider") or it.get("owned_by") or mid.split("/")[0],
+        })
+        seen.add(mid)
+
+    return catalog
+
+
+def _serialize_catalog(catalog: Dict[str, Any]) -> Tuple[bytes, str]:
+    body = dumps_bytes(catalog)
+    etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    return body, etag
+
+
+class ModelsCatalogCache:
+    """
+    Кэш каталога: готовые байты ответа + ETag.
+    Чтение синхронное и бесплатное; обновление — в фоне (stale-while-revalidate).
+    """
+
+    def __init__(self, ttl_s: float = CATALOG_TTL_SEC):
+        self.ttl_s = ttl_s
+        self.body, self.etag = _serialize_catalog(get_models_catalog())
+        self.fetched_at = 0.0  # 0 = ещё ни разу не обновляли из list_models
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.fetched_at > self.ttl_s
+
+    def snapshot(self) -> Tuple[bytes, str]:
+        """
+        Текущий ответ. Если устарел — запускаем обновление, но не ждём его.
+        """
+        if self.is_stale():
+            self.schedule_refresh()
+        return self.body, self.etag
+
+    def schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        try:
+            self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+        except RuntimeError:
+            # нет event loop (например, при импорте) — обновимся при следующем запросе
+            self._refresh_task = None
+
+    async def refresh(self):
+        # импорт здесь, чтобы models.py оставался лёгким для остальных модулей
+        from app.apifree_client import list_models
+        from app.db import log
+
+        try:
+            data = await list_models()
+            catalog = _catalog_from_list_models(data)
+        except Exception as e:
+            # оставляем прошлый каталог, повторим после ttl
+            self.fetched_at = time.monotonic()
+            await log("error", "models catalog refresh failed", {"err": str(e)})
+            return
+
+        body, etag = _serialize_catalog(catalog)
+        self.body, self.etag = body, etag
+        self.fetched_at = time.monotonic()
+
+
+models_catalog = ModelsCatalogCache()
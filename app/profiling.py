@@ -0,0 +1,191 @@
+"""
+Профилирование живого процесса (только для админа, /debug/*):
+- монитор лага event loop с гистограммой;
+- watchdog-поток: если loop завис дольше порога — снимаем стек потока loop'а
+  и пишем, какая корутина его держит;
+- сэмплирующий профайлер на N секунд (folded stacks для flamegraph).
+
+Всё дёшево: тикер раз в LOOP_MONITOR_INTERVAL_SEC, watchdog спит между проверками,
+профайлер работает только по запросу и по одному за раз.
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "1") == "1"
+LOOP_MONITOR_INTERVAL_SEC = float(os.getenv("LOOP_MONITOR_INTERVAL_SEC") or "0.25")
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS") or "200")
+
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PROFILE_MAX_SECONDS = 60.0
+PROFILE_INTERVAL_SEC = 0.005
+STACK_LIMIT = 40
+
+
+def _format_stack(frame, limit: int = STACK_LIMIT) -> List[str]:
+    return [f"{fs.filename}:{fs.lineno} {fs.name}" for fs in traceback.extract_stack(frame, limit=limit)]
+
+
+def _task_name(loop: asyncio.AbstractEventLoop) -> Optional[str]:
+    try:
+        task = asyncio.current_task(loop)
+    except Exception:
+        return None
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} {getattr(coro, '__qualname__', repr(coro))}"
+
+
+class LoopMonitor:
+    def __init__(self, interval_s: float = LOOP_MONITOR_INTERVAL_SEC, stall_ms: float = LOOP_STALL_THRESHOLD_MS):
+        self.interval_s = interval_s
+        self.stall_s = stall_ms / 1000.0
+        self.buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=50)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.perf_counter()
+        self._ticker: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---------- лаг ----------
+
+    def _observe(self, lag_ms: float):
+        i = 0
+        while i < len(LAG_BUCKETS_MS) and lag_ms > LAG_BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total_ms += lag_ms
+        if lag_ms > self.max_ms:
+            self.max_ms = lag_ms
+
+    async def _tick(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            now = time.perf_counter()
+            self._heartbeat = now
+            self._observe(max(0.0, (now - t0 - self.interval_s) * 1000.0))
+
+    # ---------- watchdog ----------
+
+    def _watch(self):
+        reported_for = None
+        while not self._stop.wait(min(0.05, self.stall_s / 4)):
+            hb = self._heartbeat
+            stalled = time.perf_counter() - hb - self.interval_s
+            if stalled < self.stall_s or reported_for == hb:
+                continue
+            reported_for = hb  # один отчёт на одно зависание
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stall = {
+                "at": time.time(),
+                "stalled_ms": round(stalled * 1000.0, 1),
+                "task": _task_name(self._loop),
+                "stack": _format_stack(frame),
+            }
+            self.stalls.append(stall)
+            self._log_later(stall)
+
+    def _log_later(self, stall: Dict[str, Any]):
+        # пишем в лог уже из loop'а, когда он освободится
+        from app.db import log
+        try:
+            asyncio.run_coroutine_threadsafe(
+                log("warning", "event loop stalled", {**stall, "stack": stall["stack"][-8:]}),
+                self._loop,
+            )
+        except Exception:
+            pass
+
+    # ---------- управление ----------
+
+    def start(self):
+        if self._ticker is not None and not self._ticker.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stop.clear()
+        self._ticker = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+            self._ticker = None
+
+    def stats(self) -> Dict[str, Any]:
+        hist = {}
+        for i, n in enumerate(self.buckets):
+            label = f"<={LAG_BUCKETS_MS[i]}ms" if i < len(LAG_BUCKETS_MS) else f">{LAG_BUCKETS_MS[-1]}ms"
+            hist[label] = n
+        return {
+            "enabled": self._ticker is not None,
+            "interval_ms": self.interval_s * 1000.0,
+            "stall_threshold_ms": self.stall_s * 1000.0,
+            "samples": self.count,
+            "avg_lag_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_lag_ms": round(self.max_ms, 1),
+            "histogram": hist,
+            "recent_stalls": list(self.stalls)[-10:],
+        }
+
+    # ---------- сэмплирующий профайлер ----------
+
+    _profile_lock = threading.Lock()
+
+    def sample_profile(self, seconds: float, interval_s: float = PROFILE_INTERVAL_SEC) -> Optional[Dict[str, Any]]:
+        """
+        Блокирующий: вызывать через asyncio.to_thread. Сэмплирует стек потока loop'а
+        и возвращает folded stacks ("a;b;c count"). None — профайлер уже занят.
+        """
+        if self._loop_thread_id is None:
+            return {"samples": 0, "folded": ""}
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+            stacks: Counter = Counter()
+            samples = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    names = []
+                    f = frame
+                    while f is not None and len(names) < STACK_LIMIT:
+                        code = f.f_code
+                        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{f.f_lineno})")
+                        f = f.f_back
+                    stacks[";".join(reversed(names))] += 1
+                    samples += 1
+                time.sleep(interval_s)
+            folded = "\n".join(f"{k} {v}" for k, v in stacks.most_common())
+            return {"seconds": seconds, "samples": samples, "folded": folded}
+        finally:
+            self._profile_lock.release()
+
+
+loop_monitor = LoopMonitor()
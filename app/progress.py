@@ -0,0 +1,85 @@
+"""
+Прогресс задачи по статусам провайдера (процент / позиция в очереди / стадия).
+
+Поллинг идёт каждые ~3 сек, но писать каждый ответ в SQLite и в Telegram
+незачем: пишем только заметные изменения и не чаще PROGRESS_MIN_INTERVAL_SEC,
+сообщение в Telegram правим ещё реже. Последнее незаписанное значение
+дописываем flush() в конце задачи (в т.ч. при drain на остановке).
+"""
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+PROGRESS_MIN_INTERVAL_SEC = float(os.getenv("PROGRESS_MIN_INTERVAL_SEC") or "5")
+PROGRESS_MIN_DELTA = int(os.getenv("PROGRESS_MIN_DELTA") or "5")  # в процентах
+PROGRESS_TG_INTERVAL_SEC = float(os.getenv("PROGRESS_TG_INTERVAL_SEC") or "15")
+
+Progress = Dict[str, Any]  # {"percent": int|None, "queue_position": int|None, "stage": str|None}
+
+
+def progress_line(p: Optional[Progress]) -> str:
+    if not p:
+        return ""
+    parts = []
+    if p.get("percent") is not None:
+        parts.append(f"{p['percent']}%")
+    if p.get("queue_position") is not None:
+        parts.append(f"в очереди у провайдера: {p['queue_position']}")
+    if not parts and p.get("stage"):
+        parts.append(str(p["stage"]))
+    return "Прогресс: " + ", ".join(parts) if parts else ""
+
+
+def _changed(prev: Optional[Progress], cur: Progress) -> bool:
+    if prev is None:
+        return True
+    if prev.get("stage") != cur.get("stage") or prev.get("queue_position") != cur.get("queue_position"):
+        return True
+    a, b = prev.get("percent"), cur.get("percent")
+    if a is None or b is None:
+        return a != b
+    return abs(b - a) >= PROGRESS_MIN_DELTA or (b == 100 and a != 100)
+
+
+class ProgressReporter:
+    """
+    Колбэк для JobContext.on_progress. write — сохранить в БД,
+    notify — показать пользователю (например, отредактировать сообщение).
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Progress], Awaitable[None]],
+        notify: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        self.write = write
+        self.notify = notify
+        self._written: Optional[Progress] = None
+        self._written_at = 0.0
+        self._notified_at = 0.0
+        self._pending: Optional[Progress] = None
+
+    async def __call__(self, progress: Progress):
+        if not _changed(self._written, progress):
+            return
+        self._pending = progress
+        now = time.monotonic()
+        if now - self._written_at < PROGRESS_MIN_INTERVAL_SEC:
+            return
+        await self._write(now)
+
+        line = progress_line(progress)
+        if self.notify is not None and line and now - self._notified_at >= PROGRESS_TG_INTERVAL_SEC:
+            self._notified_at = now
+            await self.notify(line)
+
+    async def _write(self, now: float):
+        p, self._pending = self._pending, None
+        if p is None:
+            return
+        await self.write(p)
+        self._written = p
+        self._written_at = now
+
+    async def flush(self):
+        await self._write(time.monotonic())
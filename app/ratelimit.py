@@ -0,0 +1,121 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+# Лимиты по типам задач: (задач в минуту, burst). Переопределяются env:
+# RATE_LIMIT_VIDEO="2:3" -> 2 в минуту, burst 3. "0" -> без лимита.
+DEFAULT_RULES: Dict[str, Tuple[float, int]] = {
+    "chat": (20.0, 5),
+    "image": (6.0, 3),
+    "video": (2.0, 2),
+    "music": (2.0, 2),
+    "upload": (10.0, 5),  # /api/upload, не задача, но диск общий с БД
+}
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS") or "50000")
+
+
+class RateLimited(Exception):
+    def __init__(self, jtype: str, retry_after: float):
+        super().__init__(f"rate limited: {jtype}")
+        self.jtype = jtype
+        self.retry_after = retry_after
+
+
+def _rules_from_env() -> Dict[str, Tuple[float, int]]:
+    rules = dict(DEFAULT_RULES)
+    for jtype in list(rules):
+        raw = (os.getenv(f"RATE_LIMIT_{jtype.upper()}") or "").strip()
+        if not raw:
+            continue
+        try:
+            per_min, _, burst = raw.partition(":")
+            per_min_f = float(per_min)
+            rules[jtype] = (per_min_f, int(burst) if burst else max(1, int(per_min_f)))
+        except ValueError:
+            pass
+    return rules
+
+
+class _Bucket:
+    __slots__ = ("tokens", "ts")
+
+    def __init__(self, tokens: float, ts: float):
+        self.tokens = tokens
+        self.ts = ts
+
+
+class RateLimiter:
+    """
+    Token bucket на ключ (tg_id, тип задачи). O(1) на запрос.
+    Память ограничена: ключи в OrderedDict по времени последнего обращения,
+    простаивающие (бакет уже полный) и лишние сверх max_keys выкидываются с головы.
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[float, int]], max_keys: int = RATE_LIMIT_MAX_KEYS):
+        # rate храним в токенах/сек
+        self.rules = {k: (per_min / 60.0, burst) for k, (per_min, burst) in rules.items() if per_min > 0}
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Tuple[int, str], _Bucket]" = OrderedDict()
+        self.counters: Dict[str, Dict[str, int]] = {k: {"allowed": 0, "limited": 0} for k in rules}
+        self.evicted = 0
+
+    def _idle_ttl(self, jtype: str) -> float:
+        rate, burst = self.rules[jtype]
+        return burst / rate
+
+    def _evict(self, now: float):
+        # голова OrderedDict — самые давние обращения; останавливаемся на первом активном
+        while self._buckets:
+            (tg_id, jtype), b = next(iter(self._buckets.items()))
+            if len(self._buckets) > self.max_keys or now - b.ts >= self._idle_ttl(jtype):
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+                continue
+            break
+
+    def hit(self, tg_id: int, jtype: str) -> float:
+        """
+        Списывает токен. 0.0 — можно, иначе через сколько секунд повторить.
+        """
+        rule = self.rules.get(jtype)
+        if rule is None:
+            return 0.0
+        rate, burst = rule
+        now = time.monotonic()
+        self._evict(now)
+
+        key = (int(tg_id), jtype)
+        b = self._buckets.get(key)
+        if b is None:
+            b = _Bucket(float(burst), now)
+            self._buckets[key] = b
+        else:
+            b.tokens = min(float(burst), b.tokens + (now - b.ts) * rate)
+            b.ts = now
+            self._buckets.move_to_end(key)
+
+        c = self.counters.setdefault(jtype, {"allowed": 0, "limited": 0})
+        if b.tokens >= 1.0:
+            b.tokens -= 1.0
+            c["allowed"] += 1
+            return 0.0
+
+        c["limited"] += 1
+        return (1.0 - b.tokens) / rate
+
+    def check(self, tg_id: int, jtype: str):
+        retry_after = self.hit(tg_id, jtype)
+        if retry_after > 0:
+            raise RateLimited(jtype, retry_after)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "keys": len(self._buckets),
+            "evicted": self.evicted,
+            "rules": {k: {"per_min": r * 60.0, "burst": b} for k, (r, b) in self.rules.items()},
+            "counters": self.counters,
+        }
+
+
+limiter = RateLimiter(_rules_from_env())
@@ -1,17 +1,40 @@
-from app.apifree_client import chat_completion
-
+from typing import Dict, List, Optional
 
-async def run_chat(model: str, prompt: str):
-    data = await chat_completion(model, prompt)
+from app.apifree_client import chat_completion
+from app.conversation import conversations, SUMMARY_PROMPT
 
-    text = None
 
+def _extract_text(data) -> str:
     try:
-        text = data["choices"][0]["message"]["content"]
+        return data["choices"][0]["message"]["content"]
     except Exception:
-        text = str(data)
+        return str(data)
+
+
+async def run_chat(model: str, prompt: str, tg_id: Optional[int] = None):
+    # без tg_id — как раньше, одно сообщение без истории
+    if not tg_id:
+        data = await chat_completion(model, prompt)
+        return {"text": _extract_text(data), "raw": data}
+
+    history = await conversations.get(tg_id)
+    messages = conversations.build_messages(history, prompt)
+    data = await chat_completion(model, messages=messages)
+
+    text = _extract_text(data)
+    await conversations.append(tg_id, [("user", prompt), ("assistant", text)])
 
     return {
         "text": text,
-        "raw": data
+        "raw": data,
+        "context_messages": len(messages),
     }
+
+
+def compact_history_later(model: str, tg_id: int):
+    # после доставки ответа: сжатие может стоить ещё одного запроса к модели
+    async def summarize(msgs: List[Dict[str, str]]) -> str:
+        res = await chat_completion(model, messages=[{"role": "system", "content": SUMMARY_PROMPT}, *msgs])
+        return _extract_text(res)
+
+    conversations.compact_later(tg_id, summarize)
@@ -2,5 +2,9 @@ from app.apifree_client import apifree_post_with_optional_polling
 
 async def run_image(model: str, payload: dict):
     prompt = (payload.get("prompt") or "").strip()
-    data = await apifree_post_with_optional_polling(model, {"prompt": prompt})
+    req = {"prompt": prompt}
+    # референс-картинка (из /api/upload или по ссылке)
+    if payload.get("image_url"):
+        req["image_url"] = payload["image_url"]
+    data = await apifree_post_with_optional_polling(model, req)
     return data
@@ -0,0 +1,142 @@
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+try:
+    import brotli  # опционально: если нет — отдаём только gzip
+except Exception:  # pragma: no cover
+    brotli = None
+
+WEBAPP_DIR = os.path.join(os.path.dirname(__file__), "webapp")
+URL_PREFIX = "/webapp/"
+
+# файлы, которые получают хэш в имени и ссылки на которые переписываются в index.html
+FINGERPRINT_EXT = (".js", ".css")
+# что имеет смысл сжимать
+COMPRESS_EXT = (".js", ".css", ".html", ".svg", ".json", ".txt")
+MIN_COMPRESS_SIZE = 256
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+
+
+@dataclass
+class Asset:
+    content_type: str
+    raw: bytes
+    etag: str
+    cache_control: str
+    gz: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+
+def _content_type(name: str) -> str:
+    ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if ctype.startswith("text/") or ctype in ("application/javascript", "application/json"):
+        ctype += "; charset=utf-8"
+    return ctype
+
+
+def _make_asset(name: str, raw: bytes, cache_control: str) -> Asset:
+    digest = hashlib.sha1(raw).hexdigest()
+    a = Asset(
+        content_type=_content_type(name),
+        raw=raw,
+        etag=f'"{digest[:20]}"',
+        cache_control=cache_control,
+    )
+    if name.endswith(COMPRESS_EXT) and len(raw) >= MIN_COMPRESS_SIZE:
+        gz = gzip.compress(raw, compresslevel=9, mtime=0)
+        if len(gz) < len(raw):
+            a.gz = gz
+        if brotli is not None:
+            br = brotli.compress(raw, quality=11)
+            if len(br) < len(raw):
+                a.br = br
+    return a
+
+
+def _hashed_name(name: str, raw: bytes) -> str:
+    base, ext = os.path.splitext(name)
+    return f"{base}.{hashlib.sha1(raw).hexdigest()[:10]}{ext}"
+
+
+def build_assets(directory: str = WEBAPP_DIR) -> Dict[str, Asset]:
+    """
+    Один раз при старте читаем webapp/, считаем хэши, готовим gzip/br
+    и переписываем index.html на хэшированные имена.
+    Ключ — путь относительно /webapp/ ("" = index.html).
+    """
+    assets: Dict[str, Asset] = {}
+    renames: Dict[str, str] = {}
+
+    if not os.path.isdir(directory):
+        return assets
+
+    files: Dict[str, bytes] = {}
+    for root, _, names in os.walk(directory):
+        for n in names:
+            full = os.path.join(root, n)
+            rel = os.path.relpath(full, directory).replace(os.sep, "/")
+            with open(full, "rb") as f:
+                files[rel] = f.read()
+
+    for rel, raw in files.items():
+        if rel == "index.html":
+            continue
+        # исходное имя тоже отдаём (старые index.html в кэше Telegram), но с ревалидацией
+        assets[rel] = _make_asset(rel, raw, CACHE_REVALIDATE)
+        if rel.endswith(FINGERPRINT_EXT):
+            hashed = _hashed_name(rel, raw)
+            renames[rel] = hashed
+            assets[hashed] = _make_asset(rel, raw, CACHE_IMMUTABLE)
+
+    index = files.get("index.html")
+    if index is not None:
+        html = index.decode("utf-8")
+        for rel, hashed in renames.items():
+            html = re.sub(
+                r'(["\'])' + re.escape(URL_PREFIX + rel) + r'\1',
+                lambda m: m.group(1) + URL_PREFIX + hashed + m.group(1),
+                html,
+            )
+        idx = _make_asset("index.html", html.encode("utf-8"), CACHE_REVALIDATE)
+        assets["index.html"] = idx
+        assets[""] = idx
+
+    return assets
+
+
+def pick_encoding(accept_encoding: str, asset: Asset) -> Optional[str]:
+    """
+    Простейшая negotiation по Accept-Encoding: br > gzip, учитываем q=0.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        part = part.strip()
+        if not part:
+            continue
+        token, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip()] = q
+
+    def ok(enc: str) -> bool:
+        if enc in accepted:
+            return accepted[enc] > 0
+        return accepted.get("*", 0) > 0
+
+    if asset.br is not None and ok("br"):
+        return "br"
+    if asset.gz is not None and ok("gzip"):
+        return "gzip"
+    return None
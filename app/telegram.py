@@ -1,42 +1,104 @@
 import os
 import httpx
-from typing import Optional
+from typing import Any, Dict, List, Optional
+
+from app import jobctx
+from app.tracing import span
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 TG_API = "https://api.telegram.org"
 
-async def tg_send_message(chat_id: int, text: str):
+# общий пул соединений к Bot API, закрывается в lifecycle
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=30)
+    return _client
+
+async def aclose_client():
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+async def tg_call(method: str, payload: Dict[str, Any]):
     if not BOT_TOKEN:
-        return
-    async with httpx.AsyncClient(timeout=30) as client:
-        await client.post(
-            f"{TG_API}/bot{BOT_TOKEN}/sendMessage",
-            json={"chat_id": chat_id, "text": text},
-        )
+        return None
+    # внутри задачи укладываемся в её бюджет, но на доставку всегда даём хотя бы 5 сек
+    timeout = jobctx.clamp_timeout(30.0, floor=5.0)
+    with span(f"telegram.{method}") as sp:
+        r = await get_client().post(f"{TG_API}/bot{BOT_TOKEN}/{method}", json=payload, timeout=timeout)
+        sp["http.status_code"] = r.status_code
+    return r
+
+async def tg_file_url(file_id: str) -> Optional[str]:
+    """
+    getFile -> прямая ссылка на скачивание файла (действует ~1 час).
+    """
+    if not file_id:
+        return None
+    r = await tg_call("getFile", {"file_id": file_id})
+    if r is None or r.status_code != 200:
+        return None
+    file_path = ((r.json() or {}).get("result") or {}).get("file_path")
+    if not file_path:
+        return None
+    return f"{TG_API}/file/bot{BOT_TOKEN}/{file_path}"
+
+async def tg_send_message(chat_id: int, text: str) -> Optional[int]:
+    """
+    Возвращает message_id отправленного сообщения (нужен для editMessageText).
+    """
+    r = await tg_call("sendMessage", {"chat_id": chat_id, "text": text})
+    if r is None or r.status_code != 200:
+        return None
+    try:
+        return ((r.json() or {}).get("result") or {}).get("message_id")
+    except ValueError:
+        return None
+
+async def tg_edit_message(chat_id: int, message_id: int, text: str):
+    await tg_call("editMessageText", {"chat_id": chat_id, "message_id": message_id, "text": text})
 
 async def tg_send_photo(chat_id: int, url: str, caption: Optional[str] = None):
-    if not BOT_TOKEN:
-        return
-    async with httpx.AsyncClient(timeout=30) as client:
-        payload = {"chat_id": chat_id, "photo": url}
-        if caption:
-            payload["caption"] = caption
-        await client.post(f"{TG_API}/bot{BOT_TOKEN}/sendPhoto", json=payload)
+    payload = {"chat_id": chat_id, "photo": url}
+    if caption:
+        payload["caption"] = caption
+    await tg_call("sendPhoto", payload)
 
 async def tg_send_video(chat_id: int, url: str, caption: Optional[str] = None):
-    if not BOT_TOKEN:
-        return
-    async with httpx.AsyncClient(timeout=30) as client:
-        payload = {"chat_id": chat_id, "video": url}
-        if caption:
-            payload["caption"] = caption
-        await client.post(f"{TG_API}/bot{BOT_TOKEN}/sendVideo", json=payload)
+    payload = {"chat_id": chat_id, "video": url}
+    if caption:
+        payload["caption"] = caption
+    await tg_call("sendVideo", payload)
 
 async def tg_send_audio(chat_id: int, url: str, caption: Optional[str] = None):
-    if not BOT_TOKEN:
-        return
-    async with httpx.AsyncClient(timeout=30) as client:
-        payload = {"chat_id": chat_id, "audio": url}
-        if caption:
-            payload["caption"] = caption
-        await client.post(f"{TG_API}/bot{BOT_TOKEN}/sendAudio", json=payload)
+    payload = {"chat_id": chat_id, "audio": url}
+    if caption:
+        payload["caption"] = caption
+    await tg_call("sendAudio", payload)
+
+MEDIA_GROUP_MAX = 10  # лимит Telegram на sendMediaGroup
+
+async def tg_send_media_group(chat_id: int, urls: List[str], media_type: str = "photo", caption: Optional[str] = None):
+    """
+    Несколько медиа одним запросом на каждые 10 штук. Подпись — у первого элемента.
+    Одиночный хвост отправляем обычным sendPhoto/sendVideo (группа — минимум 2).
+    """
+    single = {"photo": ("sendPhoto", "photo"), "video": ("sendVideo", "video"), "audio": ("sendAudio", "audio")}
+    for i in range(0, len(urls), MEDIA_GROUP_MAX):
+        chunk = urls[i:i + MEDIA_GROUP_MAX]
+        cap = caption if i == 0 else None
+        if len(chunk) == 1:
+            method, field = single[media_type]
+            payload = {"chat_id": chat_id, field: chunk[0]}
+            if cap:
+                payload["caption"] = cap
+            await tg_call(method, payload)
+            continue
+        media = [{"type": media_type, "media": u} for u in chunk]
+        if cap:
+            media[0]["caption"] = cap
+        await tg_call("sendMediaGroup", {"chat_id": chat_id, "media": media})
@@ -0,0 +1,157 @@
+"""
+Лёгкий трейсинг: trace id на задачу, спаны в кольцевом буфере в памяти,
+экспорт в JSON формата OTLP (OpenTelemetry) для /debug/jobs/{id}/trace.
+
+Спан пишется только если текущий трейс засэмплирован; иначе span() — это
+один ContextVar.get() и return.
+"""
+import os
+import time
+import random
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# по умолчанию пишем ~5% задач; для разбора инцидента админ поднимает до 1.0
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE") or "0.05")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE") or "20000")
+SERVICE_NAME = "guurenko-ai"
+
+# (trace_id, span_id текущего спана или None); trace_id "" — решено не сэмплировать
+_current: ContextVar[Optional[Tuple[str, Optional[str]]]] = ContextVar("trace_current", default=None)
+_UNSAMPLED = ("", None)
+
+# спан: (trace_id, span_id, parent_id, name, start_ns, end_ns, error, attrs)
+_SpanRow = Tuple[str, str, Optional[str], str, int, int, Optional[str], Dict[str, Any]]
+_buffer: Deque[_SpanRow] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def new_trace_id() -> Optional[str]:
+    """
+    Новый trace id (32 hex) или None, если трейс не попал в выборку.
+    """
+    if TRACE_SAMPLE_RATE < 1.0 and random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    return os.urandom(16).hex()
+
+
+def job_trace_id() -> Optional[str]:
+    """
+    trace id для новой задачи: решение текущего запроса (в т.ч. «не сэмплировать»)
+    или, если трейса нет вовсе, новое. Повторно не бросаем — иначе доля выше TRACE_SAMPLE_RATE.
+    """
+    cur = _current.get()
+    if cur is not None:
+        return cur[0] or None
+    return new_trace_id()
+
+
+def sampled() -> bool:
+    """
+    Пишется ли текущий трейс: дорогие атрибуты спана считаем только тогда.
+    """
+    cur = _current.get()
+    return cur is not None and bool(cur[0])
+
+
+@contextmanager
+def trace(trace_id: Optional[str]) -> Iterator[None]:
+    """
+    Сделать trace_id текущим (None — не сэмплировано, внутри ничего не пишем).
+    """
+    token = _current.set((trace_id, None) if trace_id else _UNSAMPLED)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    with span("apifree.request", method="GET") as sp: ...; sp["http.status_code"] = 200
+    """
+    cur = _current.get()
+    if cur is None or not cur[0]:
+        yield attrs
+        return
+
+    trace_id, parent_id = cur
+    span_id = os.urandom(8).hex()
+    token = _current.set((trace_id, span_id))
+    start = time.time_ns()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__ if not str(e) else f"{type(e).__name__}: {str(e)[:200]}"
+        raise
+    finally:
+        _current.reset(token)
+        _buffer.append((trace_id, span_id, parent_id, name, start, time.time_ns(), error, attrs))
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attrs: Any):
+    """
+    Готовый спан задним числом (например, ожидание в очереди).
+    """
+    cur = _current.get()
+    if cur is None or not cur[0]:
+        return
+    trace_id, parent_id = cur
+    _buffer.append((trace_id, os.urandom(8).hex(), parent_id, name, start_ns, end_ns, None, attrs))
+
+
+# ---------- export ----------
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def get_spans(trace_id: str) -> List[_SpanRow]:
+    return sorted((s for s in list(_buffer) if s[0] == trace_id), key=lambda s: s[4])
+
+
+def export_trace(trace_id: str) -> Dict[str, Any]:
+    """
+    OTLP/JSON (ExportTraceServiceRequest) — можно отправить в любой OTel collector.
+    """
+    spans = []
+    for tid, sid, parent, name, start, end, error, attrs in get_spans(trace_id):
+        item: Dict[str, Any] = {
+            "traceId": tid,
+            "spanId": sid,
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(end),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items() if v is not None],
+            "status": {"code": 2, "message": error} if error else {"code": 1},
+        }
+        if parent:
+            item["parentSpanId"] = parent
+        spans.append(item)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+def summarize_trace(trace_id: str) -> List[Dict[str, Any]]:
+    """
+    Короткая сводка для человека: имя, длительность в мс, ошибка.
+    """
+    out = []
+    for _, _, _, name, start, end, error, attrs in get_spans(trace_id):
+        out.append({"name": name, "ms": round((end - start) / 1e6, 1), "error": error, **attrs})
+    return out
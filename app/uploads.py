@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import shutil
+import hashlib
+import tempfile
+from typing import BinaryIO, Iterable, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.db import DB_PATH
+
+# картинки для image-to-video / референсов; имя файла = sha256 содержимого (дедуп)
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or os.path.join(os.path.dirname(DB_PATH), "uploads")
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB") or "20") * 1024 * 1024)
+# заголовки multipart и поле tg_id поверх самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+# диск общий с SQLite: меньше этого свободного места — загрузки не принимаем
+UPLOAD_MIN_FREE_BYTES = int(float(os.getenv("UPLOAD_MIN_FREE_MB") or "200") * 1024 * 1024)
+# файлы старше этого, на которые не ссылается ни одна активная задача, удаляем
+UPLOAD_MAX_AGE_SEC = float(os.getenv("UPLOAD_MAX_AGE_SEC") or "86400")
+UPLOAD_CLEANUP_INTERVAL_SEC = float(os.getenv("UPLOAD_CLEANUP_INTERVAL_SEC") or "3600")
+CHUNK_SIZE = 64 * 1024
+
+IMAGE_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+}
+_NAME_RE = re.compile(r"^[0-9a-f]{64}\.(jpg|png|webp)$")
+_REF_RE = re.compile(r"/uploads/([0-9a-f]{64}\.(?:jpg|png|webp))")
+
+
+class UploadError(ValueError):
+    pass
+
+
+def is_valid_name(name: str) -> bool:
+    return bool(_NAME_RE.match(name or ""))
+
+
+def upload_path(name: str) -> str:
+    return os.path.join(UPLOAD_DIR, name)
+
+
+def public_url(base_url: str, name: str) -> str:
+    return f"{base_url.rstrip('/')}/uploads/{name}"
+
+
+class _HashingWriter:
+    """
+    Пишет чанки во временный файл в UPLOAD_DIR, параллельно считая sha256 и размер.
+    В памяти держим только текущий чанк.
+    """
+
+    def __init__(self, ext: str):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+        self.f = os.fdopen(fd, "wb")
+        self.ext = ext
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > MAX_UPLOAD_BYTES:
+            raise UploadError(f"файл больше {MAX_UPLOAD_BYTES // (1024 * 1024)} МБ")
+        self.sha.update(chunk)
+        self.f.write(chunk)
+
+    def commit(self) -> Tuple[str, int]:
+        self.f.close()
+        if not self.size:
+            self.abort()
+            raise UploadError("пустой файл")
+        name = self.sha.hexdigest() + self.ext
+        final = upload_path(name)
+        if os.path.exists(final):
+            # такой файл уже есть — дубль не храним, но продлеваем ему жизнь (см. cleanup_uploads)
+            os.remove(self.tmp_path)
+            os.utime(final)
+        else:
+            os.replace(self.tmp_path, final)
+        return name, self.size
+
+    def abort(self):
+        try:
+            self.f.close()
+        except Exception:
+            pass
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def ext_for_content_type(content_type: Optional[str]) -> str:
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    ext = IMAGE_TYPES.get(ctype)
+    if not ext:
+        raise UploadError(f"неподдерживаемый тип файла: {ctype or 'unknown'}")
+    return ext
+
+
+def _copy_fileobj(src: BinaryIO, ext: str) -> Tuple[str, int]:
+    w = _HashingWriter(ext)
+    try:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            w.write(chunk)
+        return w.commit()
+    except BaseException:
+        w.abort()
+        raise
+
+
+async def save_upload(fileobj: BinaryIO, content_type: Optional[str]) -> Tuple[str, int]:
+    """
+    Сохраняет загруженный файл (SpooledTemporaryFile из multipart) по sha256.
+    Копирование идёт в threadpool, чтобы не блокировать event loop.
+    Возвращает (имя файла, размер).
+    """
+    ext = ext_for_content_type(content_type)
+    return await run_in_threadpool(_copy_fileobj, fileobj, ext)
+
+
+async def save_from_url(client, url: str, content_type: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Скачивает файл потоком (например, фото из Telegram) прямо в хранилище.
+    """
+    async with client.stream("GET", url) as r:
+        r.raise_for_status()
+        ext = ext_for_content_type(content_type or r.headers.get("content-type") or "image/jpeg")
+        w = _HashingWriter(ext)
+        try:
+            async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                w.write(chunk)
+            return w.commit()
+        except BaseException:
+            w.abort()
+            raise
+
+
+def has_free_space() -> bool:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return shutil.disk_usage(UPLOAD_DIR).free >= UPLOAD_MIN_FREE_BYTES
+
+
+def referenced_names(payloads: Iterable[str]) -> Set[str]:
+    """
+    Имена загрузок, на которые ссылаются payload_json задач (image_url = .../uploads/<name>).
+    """
+    names: Set[str] = set()
+    for p in payloads:
+        names.update(_REF_RE.findall(p or ""))
+    return names
+
+
+def cleanup_uploads(keep: Set[str], max_age_s: float = UPLOAD_MAX_AGE_SEC) -> int:
+    """
+    Блокирующая: удаляет файлы (и брошенные .part) старше max_age_s, кроме keep.
+    Возвращает число удалённых.
+    """
+    if not os.path.isdir(UPLOAD_DIR):
+        return 0
+    cutoff = time.time() - max_age_s
+    removed = 0
+    for entry in os.scandir(UPLOAD_DIR):
+        if not entry.is_file() or entry.name in keep:
+            continue
+        if not (is_valid_name(entry.name) or entry.name.endswith(".part")):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -30,12 +30,26 @@ function fillSelect(sel, items) {
   }
 }
 
+function jobStatusLine(j) {
+  let line = `job ${j.id}: ${j.status}…`;
+  const q = j.queue;
+  if (j.status === "queued" && q && q.position > 1) {
+    line += `\nВ очереди: ${q.position}, старт примерно через ${Math.max(1, Math.round(q.estimated_wait_s / 60))} мин.`;
+  }
+  const p = j.progress;
+  if (j.status === "running" && p) {
+    if (p.percent != null) line += `\nПрогресс: ${p.percent}%`;
+    if (p.queue_position != null) line += `\nВ очереди у провайдера: ${p.queue_position}`;
+  }
+  return line;
+}
+
 async function pollJob(jobId, onUpdate) {
   const deadline = Date.now() + 30 * 60 * 1000; // 30 минут вместо "690 секунд"
   while (Date.now() < deadline) {
     const j = await api(`/api/job/${jobId}`);
     onUpdate(j);
-    if (j.status === "done" || j.status === "error") return j;
+    if (["done", "error", "cancelled", "timeout"].includes(j.status)) return j;
     await new Promise(r => setTimeout(r, 2000));
   }
   throw new Error("Тайм-аут ожидания результата (30 минут).");
@@ -86,7 +100,7 @@ document.getElementById("btn-chat").addEventListener("click", async () => {
     };
     const res = await api("/api/chat", { method:"POST", body: JSON.stringify(body) });
     out.textContent = `Создан job: ${res.job_id}\nОжидаю ответ…`;
-    const job = await pollJob(res.job_id, (j) => out.textContent = `job ${j.id}: ${j.status}…`);
+    const job = await pollJob(res.job_id, (j) => out.textContent = jobStatusLine(j));
     if (job.status === "done") {
       out.textContent = job.result?.text || JSON.stringify(job.result, null, 2);
     } else {
@@ -109,10 +123,10 @@ document.getElementById("btn-image").addEventListener("click", async () => {
     };
     const res = await api("/api/image/submit", { method:"POST", body: JSON.stringify(body) });
     out.textContent = `Создан job: ${res.job_id}\nОжидаю…`;
-    const job = await pollJob(res.job_id, (j) => out.textContent = `job ${j.id}: ${j.status}…`);
+    const job = await pollJob(res.job_id, (j) => out.textContent = jobStatusLine(j));
     if (job.status === "done") {
-      const url = job.result?.url;
-      out.innerHTML = `<div>Готово ✅</div><a href="${url}" target="_blank">${url}</a><img src="${url}" />`;
+      const urls = job.media_urls?.length ? job.media_urls : [job.result?.url];
+      out.innerHTML = `<div>Готово ✅</div>` + urls.map(url => `<a href="${url}" target="_blank">${url}</a><img src="${url}" />`).join("");
     } else out.textContent = "Ошибка: " + (job.error || "unknown");
   } catch (e) {
     out.textContent = "Ошибка: " + e.message;
@@ -129,11 +143,22 @@ document.getElementById("btn-video").addEventListener("click", async () => {
       model: document.getElementById("model-video").value,
       prompt: document.getElementById("input-video").value
     };
+    const file = document.getElementById("file-video").files[0];
+    if (file) {
+      out.textContent = "Загружаю фото…";
+      const fd = new FormData();
+      fd.append("tg_id", String(body.tg_id));
+      fd.append("file", file);
+      const r = await fetch(`/api/upload?tg_id=${encodeURIComponent(body.tg_id)}`, { method: "POST", body: fd });
+      const up = await r.json().catch(() => ({}));
+      if (!r.ok) throw new Error(up.detail || `HTTP ${r.status}`);
+      body.upload_id = up.upload_id;
+    }
     const res = await api("/api/video/submit", { method:"POST", body: JSON.stringify(body) });
     out.textContent = `Создан job: ${res.job_id}\nОжидаю…`;
-    const job = await pollJob(res.job_id, (j) => out.textContent = `job ${j.id}: ${j.status}…`);
+    const job = await pollJob(res.job_id, (j) => out.textContent = jobStatusLine(j));
     if (job.status === "done") {
-      const url = job.result?.url;
+      const url = job.media_urls?.[0] || job.result?.url;
       out.innerHTML = `<div>Готово ✅</div><a href="${url}" target="_blank">${url}</a><video controls src="${url}"></video>`;
     } else out.textContent = "Ошибка: " + (job.error || "unknown");
   } catch (e) {
@@ -154,9 +179,9 @@ document.getElementById("btn-music").addEventListener("click", async () => {
     };
     const res = await api("/api/music/submit", { method:"POST", body: JSON.stringify(body) });
     out.textContent = `Создан job: ${res.job_id}\nОжидаю…`;
-    const job = await pollJob(res.job_id, (j) => out.textContent = `job ${j.id}: ${j.status}…`);
+    const job = await pollJob(res.job_id, (j) => out.textContent = jobStatusLine(j));
     if (job.status === "done") {
-      const url = job.result?.url;
+      const url = job.media_urls?.[0] || job.result?.url;
       out.innerHTML = `<div>Готово ✅</div><a href="${url}" target="_blank">${url}</a><audio controls src="${url}"></audio>`;
     } else out.textContent = "Ошибка: " + (job.error || "unknown");
   } catch (e) {
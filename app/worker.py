@@ -1,65 +1,114 @@
-import json
+import os
+import time
+import socket
 import asyncio
+import httpx
 import aiosqlite
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 
-from app.db import DB_PATH, log
+from app.db import DB_PATH, log, claim_next_job, worker_heartbeat, reclaim_stale_jobs
+from app.jsonx import dumps_safe, loads
 from app.queue import dequeue
-from app.telegram import tg_send_message, tg_send_photo, tg_send_video, tg_send_audio
-
-from app.services.chat import run_chat
+from app.admission import admission
+from app import jobctx
+from app.jobctx import job_deadline_s
+from app.apifree_client import APIFreeTimeout, apifree_poll_task
+from app import tracing
+from app.tracing import span
+from app.progress import ProgressReporter
+from app.telegram import tg_send_message, tg_edit_message, tg_send_media_group, tg_send_video, tg_send_audio
+
+from app.services.chat import run_chat, compact_history_later
 from app.services.image import run_image
 from app.services.video import run_video
 from app.services.music import run_music
 
 
+# запас сверх бюджета задачи, после которого рубим её жёстко
+DEADLINE_GRACE_SEC = 30.0
+
+# сколько задач один процесс выполняет одновременно
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY") or "1")
+# как часто смотреть в БД, если in-memory очередь пуста (другие процессы / API без воркера)
+WORKER_POLL_SEC = float(os.getenv("WORKER_POLL_SEC") or "2")
+WORKER_HEARTBEAT_SEC = float(os.getenv("WORKER_HEARTBEAT_SEC") or "10")
+# нет heartbeat дольше этого — воркер считаем мёртвым, его задачи возвращаем в очередь
+WORKER_STALE_SEC = float(os.getenv("WORKER_STALE_SEC") or "60")
+
+# финальная правка статуса не должна затягивать drain
+STATUS_EDIT_TIMEOUT_SEC = 5.0
+
+# заголовок статус-сообщения, в которое дописываем прогресс
+_STATUS_TITLES = {
+    "chat": "Думаю",
+    "image": "Генерирую изображение",
+    "video": "Генерирую видео",
+    "music": "Генерирую музыку",
+}
+
+
 # --------- helpers ---------
 
 def _json_dumps(x) -> str:
-    try:
-        return json.dumps(x, ensure_ascii=False)
-    except Exception:
-        return json.dumps({"raw": str(x)}, ensure_ascii=False)
+    return dumps_safe(x)
+
+# Самые частые ключи со ссылками
+_DIRECT_KEYS = {
+    "image": ["url", "image_url", "image", "output_url", "result_url", "images", "urls"],
+    "video": ["url", "video_url", "video", "output_url", "result_url", "videos", "urls"],
+    "audio": ["url", "audio_url", "audio", "output_url", "result_url", "audios", "urls"],
+}
+_CONTAINER_KEYS = ("result", "output", "data", "outputs", "results")
 
-def _pick_url(result: dict, kind: str) -> str | None:
+
+def _pick_urls(result: dict, kind: str) -> List[str]:
     """
-    Универсально вытаскиваем ссылку из ответа.
+    Универсально вытаскиваем ВСЕ ссылки на медиа из ответа (по порядку, без дублей).
     kind: "image" | "video" | "audio"
     """
     if not isinstance(result, dict):
-        return None
-
-    # Самые частые ключи
-    direct_keys = {
-        "image": ["url", "image_url", "image", "output_url", "result_url"],
-        "video": ["url", "video_url", "video", "output_url", "result_url"],
-        "audio": ["url", "audio_url", "audio", "output_url", "result_url"],
-    }
-
-    for k in direct_keys.get(kind, []):
-        v = result.get(k)
-        if isinstance(v, str) and v.startswith("http"):
-            return v
+        return []
+
+    keys = _DIRECT_KEYS.get(kind, [])
+    out: List[str] = []
+
+    def add(v):
+        if isinstance(v, str):
+            if v.startswith("http") and v not in out:
+                out.append(v)
+        elif isinstance(v, list):
+            # иногда список ссылок или список {"url": ...}
+            for item in v:
+                if isinstance(item, dict):
+                    from_dict(item)
+                else:
+                    add(item)
+
+    def from_dict(d: dict):
+        for k in keys:
+            add(d.get(k))
+        if "file_url" in d:
+            add(d.get("file_url"))
+
+    from_dict(result)
 
     # Если результат вложенный: result/output/data
-    for container_key in ("result", "output", "data"):
+    for container_key in _CONTAINER_KEYS:
         v = result.get(container_key)
         if isinstance(v, dict):
-            for k in direct_keys.get(kind, []):
-                vv = v.get(k)
-                if isinstance(vv, str) and vv.startswith("http"):
-                    return vv
-        if isinstance(v, list) and v:
-            # иногда список ссылок
-            vv = v[0]
-            if isinstance(vv, str) and vv.startswith("http"):
-                return vv
-            if isinstance(vv, dict):
-                for k in direct_keys.get(kind, []):
-                    vvv = vv.get(k)
-                    if isinstance(vvv, str) and vvv.startswith("http"):
-                        return vvv
-
-    return None
+            from_dict(v)
+        elif isinstance(v, list):
+            add(v)
+
+    return out
+
+
+def _with_media_urls(result, urls: List[str]):
+    # полный список ссылок храним в самом результате — его отдаёт /api/job
+    if isinstance(result, dict):
+        result["media_urls"] = urls
+    return result
 
 
 async def _update_job(job_id: int, **fields):
@@ -71,15 +120,53 @@ async def _update_job(job_id: int, **fields):
     params.append(job_id)
 
     sql = f"UPDATE jobs SET {', '.join(sets)}, updated_at=datetime('now') WHERE id=?"
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(sql, params)
-        await db.commit()
+    with span("db.update_job", fields=",".join(fields)):
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(sql, params)
+            await db.commit()
+
+
+class _JobSuperseded(Exception):
+    """
+    Задачу отменили (через API, возможно из другого процесса) или её забрал другой воркер:
+    результат не пишем и не доставляем.
+    """
+
+
+async def _transition(job_id: int, owner: Optional[str], status: str, allowed=("running",), **fields) -> bool:
+    """
+    Смена статуса с проверкой: задача всё ещё в allowed и за воркером owner.
+    Отмена из API видна чужому процессу только на heartbeat — без проверки
+    воркер мог бы перезаписать 'cancelled' и доставить уже возвращённый кредитом результат.
+    """
+    sets = ["status=?"] + [f"{k}=?" for k in fields]
+    params = [status, *fields.values(), job_id, *allowed]
+    marks = ",".join("?" for _ in allowed)
+    if status == "queued":
+        # queue.wait следующего запуска считаем от этого момента, а не от created_at
+        sets.append("requeued_at=datetime('now')")
+    sql = f"UPDATE jobs SET {', '.join(sets)}, updated_at=datetime('now') WHERE id=? AND status IN ({marks})"
+    if owner:
+        sql += " AND worker_id=?"
+        params.append(owner)
+    with span("db.update_job", fields=",".join(["status", *fields])):
+        async with aiosqlite.connect(DB_PATH) as db:
+            cur = await db.execute(sql, params)
+            changed = cur.rowcount
+            await cur.close()
+            await db.commit()
+    return bool(changed)
+
+
+async def _finish(job_id: int, worker_id: Optional[str], **fields):
+    if not await _transition(job_id, worker_id, "done", **fields):
+        raise _JobSuperseded()
 
 
 async def _get_job(job_id: int):
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
-            "SELECT id, tg_id, type, model, prompt, payload_json FROM jobs WHERE id=?",
+            "SELECT id, tg_id, type, model, prompt, payload_json, status, upstream_task_id, trace_id, COALESCE(requeued_at, created_at) FROM jobs WHERE id=?",
             (job_id,),
         )
         row = await cur.fetchone()
@@ -87,95 +174,372 @@ async def _get_job(job_id: int):
         return row
 
 
-# --------- worker loop ---------
+async def _job_status(job_id: int) -> Optional[str]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT status FROM jobs WHERE id=?", (job_id,))
+        row = await cur.fetchone()
+        await cur.close()
+    return row[0] if row else None
 
-async def worker_loop():
-    await log("info", "worker started")
 
-    while True:
-        job_id = await dequeue()
-        if not job_id:
-            await asyncio.sleep(0.2)
-            continue
+async def _status_message_id(job_id: int) -> Optional[int]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT status_message_id FROM jobs WHERE id=?", (job_id,))
+        row = await cur.fetchone()
+        await cur.close()
+    return int(row[0]) if row and row[0] else None
+
+
+async def _edit_status(job_id: int, tg_id: int, text: str):
+    # id читаем при каждой правке: webhook мог сохранить его уже после старта задачи
+    mid = await _status_message_id(job_id)
+    if mid:
+        await tg_edit_message(tg_id, mid, text)
 
-        try:
-            row = await _get_job(job_id)
-            if not row:
-                continue
 
-            _, tg_id, jtype, model, prompt, payload_json = row
-            tg_id = int(tg_id)
+def _progress_reporter(job_id: int, tg_id: int, jtype: str) -> ProgressReporter:
+    async def write(progress: dict):
+        await _update_job(job_id, progress_json=_json_dumps(progress))
 
-            await _update_job(job_id, status="running", error=None)
+    async def notify(line: str):
+        await _edit_status(job_id, tg_id, f"⏳ {_STATUS_TITLES.get(jtype, 'Работаю')}… (job {job_id})\n{line}")
 
-            payload = {}
-            if payload_json:
-                try:
-                    payload = json.loads(payload_json)
-                except Exception:
-                    payload = {}
+    return ProgressReporter(write, notify)
 
-            # ВАЖНО: всегда проставляем prompt в payload, чтобы сервисы были единообразны
-            if "prompt" not in payload and prompt:
-                payload["prompt"] = prompt
 
-            # -------- RUN --------
-            if jtype == "chat":
-                # chat сейчас проще: model + текст
-                result = await run_chat(model, prompt)
-                await _update_job(job_id, status="done", result_json=_json_dumps(result))
+# --------- job processing ---------
 
-                text = None
-                if isinstance(result, dict):
-                    text = result.get("text") or result.get("message")
-                await tg_send_message(tg_id, text or "Готово ✅")
+async def _run_job(job_id: int, tg_id: int, jtype: str, model: str, prompt: str, payload: dict, upstream_task_id: str | None, worker_id: Optional[str]) -> bool:
+    # upstream_task_id есть — задачу у провайдера уже создавали (timeout / рестарт):
+    # продолжаем поллинг, а не оплачиваем генерацию заново
+    if jtype == "chat":
+        # chat сейчас проще: model + текст
+        result = await run_chat(model, prompt, tg_id)
+        await _finish(job_id, worker_id, result_json=_json_dumps(result))
 
-            elif jtype == "image":
-                # image: model + payload dict
-                result = await run_image(model, payload)
-                await _update_job(job_id, status="done", result_json=_json_dumps(result))
+        text = None
+        if isinstance(result, dict):
+            text = result.get("text") or result.get("message")
+        await tg_send_message(tg_id, text or "Готово ✅")
+        compact_history_later(model, tg_id)
 
-                url = _pick_url(result, "image")
-                if not url:
-                    raise RuntimeError(f"Image result has no URL. Result: {result}")
+    elif jtype == "image":
+        # image: model + payload dict
+        result = await (apifree_poll_task(upstream_task_id) if upstream_task_id else run_image(model, payload))
 
-                await tg_send_photo(tg_id, url, caption="Готово ✅")
+        urls = _pick_urls(result, "image")
+        if not urls:
+            raise RuntimeError(f"Image result has no URL. Result: {result}")
+        await _finish(job_id, worker_id, result_json=_json_dumps(_with_media_urls(result, urls)))
 
-            elif jtype == "video":
-                result = await run_video(model, payload)
-                await _update_job(job_id, status="done", result_json=_json_dumps(result))
+        # все картинки одним sendMediaGroup (по 10 штук)
+        await tg_send_media_group(tg_id, urls, "photo", caption="Готово ✅")
 
-                url = _pick_url(result, "video")
-                if not url:
-                    raise RuntimeError(f"Video result has no URL. Result: {result}")
+    elif jtype == "video":
+        result = await (apifree_poll_task(upstream_task_id) if upstream_task_id else run_video(model, payload))
 
-                await tg_send_video(tg_id, url, caption="Готово ✅")
+        urls = _pick_urls(result, "video")
+        if not urls:
+            raise RuntimeError(f"Video result has no URL. Result: {result}")
+        url = urls[0]
+        await _finish(job_id, worker_id, result_json=_json_dumps(_with_media_urls(result, urls)))
 
-            elif jtype == "music":
-                # music: model + payload dict (lyrics/style)
-                # подстрахуем:
-                if "lyrics" not in payload:
-                    payload["lyrics"] = payload.get("prompt") or prompt or ""
-                result = await run_music(model, payload)
-                await _update_job(job_id, status="done", result_json=_json_dumps(result))
+        await tg_send_video(tg_id, url, caption="Готово ✅")
 
-                url = _pick_url(result, "audio")
-                if not url:
-                    raise RuntimeError(f"Audio result has no URL. Result: {result}")
+    elif jtype == "music":
+        # music: model + payload dict (lyrics/style)
+        # подстрахуем:
+        if "lyrics" not in payload:
+            payload["lyrics"] = payload.get("prompt") or prompt or ""
+        result = await (apifree_poll_task(upstream_task_id) if upstream_task_id else run_music(model, payload))
 
-                await tg_send_audio(tg_id, url, caption="Готово ✅")
+        urls = _pick_urls(result, "audio")
+        if not urls:
+            raise RuntimeError(f"Audio result has no URL. Result: {result}")
+        url = urls[0]
+        await _finish(job_id, worker_id, result_json=_json_dumps(_with_media_urls(result, urls)))
 
-            else:
-                await _update_job(job_id, status="error", error=f"unknown job type: {jtype}")
-                await tg_send_message(tg_id, "Ошибка: неизвестный тип задачи")
+        await tg_send_audio(tg_id, url, caption="Готово ✅")
 
-        except Exception as e:
-            await log("error", "worker error", {"job_id": job_id, "err": str(e)})
+    else:
+        if await _transition(job_id, worker_id, "error", error=f"unknown job type: {jtype}"):
+            await tg_send_message(tg_id, "Ошибка: неизвестный тип задачи")
+        return False
+
+    return True
+
+
+async def process_job(job_id: int, worker_id: Optional[str] = None) -> bool:
+    """
+    Выполняет одну задачу целиком: upstream + сохранение + доставка в Telegram,
+    в пределах бюджета времени по типу/модели (jobctx.job_deadline_s).
+    Все ошибки ловятся здесь; CancelledError пробрасывается наверх (drain / отмена).
+    True — задача успешно выполнена.
+    """
+    tg_id = None
+    try:
+        row = await _get_job(job_id)
+        if not row:
+            return False
+
+        _, tg_id, jtype, model, prompt, payload_json, status, upstream_task_id, trace_id, queued_at = row
+        tg_id = int(tg_id)
+
+        if status == "cancelled":
+            # отменили, пока задача стояла в очереди
+            return False
+
+        with tracing.trace(trace_id), span("job.run", job_id=job_id, type=jtype, model=model):
+            _record_queue_wait(queued_at)
+            return await _process_loaded_job(job_id, tg_id, jtype, model, prompt, payload_json, upstream_task_id, worker_id)
+
+    except asyncio.CancelledError:
+        raise
+
+    except Exception as e:
+        await log("error", "worker error", {"job_id": job_id, "err": str(e)})
+        try:
+            await _transition(job_id, worker_id, "error", allowed=("queued", "running"), error=str(e))
+        except Exception:
+            pass
+        return False
+
+
+def _record_queue_wait(queued_at: str | None):
+    # queued_at — когда задача последний раз встала в очередь (requeued_at или created_at):
+    # datetime('now') из SQLite (UTC, точность до секунды)
+    if not queued_at:
+        return
+    try:
+        ts = datetime.strptime(queued_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return
+    tracing.record_span("queue.wait", int(ts * 1e9), time.time_ns())
+
+
+async def _process_loaded_job(job_id: int, tg_id: int, jtype: str, model: str, prompt: str, payload_json: str | None, upstream_task_id: str | None, worker_id: Optional[str] = None) -> bool:
+    budget = None
+    ctx = None
+    reporter = _progress_reporter(job_id, tg_id, jtype)
+    # чем закончилась задача — этим заменяем прогресс в статус-сообщении
+    outcome: Optional[str] = "❌ Ошибка"
+    try:
+        if not await _transition(job_id, worker_id, "running", allowed=("queued", "running"), error=None):
+            # отменили между claim и стартом
+            outcome = None
+            return False
+
+        payload = {}
+        if payload_json:
             try:
-                await _update_job(job_id, status="error", error=str(e))
+                payload = loads(payload_json)
             except Exception:
-                pass
+                payload = {}
+
+        # ВАЖНО: всегда проставляем prompt в payload, чтобы сервисы были единообразны
+        if "prompt" not in payload and prompt:
+            payload["prompt"] = prompt
+
+        async def _remember_task_id(task_id: str):
+            await _update_job(job_id, upstream_task_id=task_id)
+
+        budget = job_deadline_s(jtype, model)
+        ctx = jobctx.JobContext(
+            job_id=job_id,
+            deadline=asyncio.get_running_loop().time() + budget,
+            on_task_id=_remember_task_id,
+            on_progress=reporter,
+        )
+        with jobctx.job_context(ctx):
+            # поллинг сам останавливается на дедлайне; wait_for — страховка от зависаний
+            ok = await asyncio.wait_for(
+                _run_job(job_id, tg_id, jtype, model, prompt, payload, upstream_task_id, worker_id),
+                timeout=budget + DEADLINE_GRACE_SEC,
+            )
+        if ok:
+            outcome = "✅ Готово"
+        return ok
+
+    except asyncio.CancelledError:
+        # отмена пользователем или drain на остановке (задача вернётся в очередь)
+        outcome = "⛔️ Отменено" if ctx is not None and ctx.cancel_upstream else "🔄 Перезапуск сервиса — продолжу позже"
+        raise
+
+    except _JobSuperseded:
+        outcome = "⛔️ Отменено" if await _job_status(job_id) == "cancelled" else None
+        await log("info", "job result dropped", {"job_id": job_id, "worker_id": worker_id})
+        return False
+
+    except (APIFreeTimeout, asyncio.TimeoutError, httpx.TimeoutException) as e:
+        outcome = "⏱ Время вышло"
+        err = f"timeout after {int(budget or 0)}s"
+        if isinstance(e, APIFreeTimeout):
+            err += f", upstream task_id={e.task_id}"
+        await log("info", "job timeout", {"job_id": job_id, "err": err})
+        try:
+            if not await _transition(job_id, worker_id, "timeout", error=err):
+                outcome = None
+                return False
+        except Exception:
+            pass
+        try:
+            if tg_id is not None:
+                msg = f"⏱ Не дождались результата за {max(1, int(budget or 0) // 60)} мин."
+                if isinstance(e, APIFreeTimeout):
+                    msg += f" Провайдер ещё может доделать — /resume {job_id}"
+                await tg_send_message(tg_id, msg)
+        except Exception:
+            pass
+        return False
+
+    except Exception as e:
+        err = str(e) or type(e).__name__
+        await log("error", "worker error", {"job_id": job_id, "err": err})
+        try:
+            if not await _transition(job_id, worker_id, "error", error=err):
+                outcome = None
+                return False
+        except Exception:
+            pass
+        try:
+            if tg_id is not None:
+                await tg_send_message(tg_id, f"Ошибка: {err}")
+        except Exception:
+            pass
+        return False
+
+    finally:
+        # последнее значение, придержанное коалесцированием (в т.ч. при drain на остановке)
+        try:
+            await reporter.flush()
+        except Exception:
+            pass
+        # старый процент рядом с результатом сбивает с толку — финальная правка статуса
+        if outcome is not None:
             try:
-                await tg_send_message(int(row[1]) if row else tg_id, f"Ошибка: {e}")
+                await asyncio.wait_for(_edit_status(job_id, tg_id, f"{outcome} (job {job_id})"), timeout=STATUS_EDIT_TIMEOUT_SEC)
             except Exception:
                 pass
+
+
+# --------- worker loop ---------
+
+class Worker:
+    """
+    Воркер процесса: выполняет до `concurrency` задач одновременно.
+    Задачи забирает атомарно через БД (claim_next_job), поэтому рядом могут работать
+    другие процессы (python -m app.worker). Когда в БД пусто, ждём in-memory очередь
+    (use_queue — воркер внутри процесса API, будит сразу после enqueue) или
+    следующий опрос раз в WORKER_POLL_SEC.
+    stop() перестаёт брать новые; текущие задачи видны в inflight (для drain).
+    """
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, use_queue: bool = True):
+        self.concurrency = max(1, concurrency)
+        self.use_queue = use_queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(3).hex()}"
+        self.stopping = asyncio.Event()
+        self.inflight: Dict[int, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._closing = asyncio.Event()
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    async def _next_job(self) -> Optional[int]:
+        # сначала БД: свободные слоты заполняются сразу, без ожидания очереди
+        while not self.stopping.is_set():
+            job_id = await claim_next_job(self.worker_id)
+            if job_id is not None:
+                return job_id
+            # пусто — ждём enqueue (только сигнал «появилась задача», берём всё равно из БД по порядку),
+            # остановку или следующий опрос
+            waits = {asyncio.ensure_future(self.stopping.wait())}
+            if self.use_queue:
+                waits.add(asyncio.ensure_future(dequeue()))
+            _, pending = await asyncio.wait(waits, timeout=WORKER_POLL_SEC, return_when=asyncio.FIRST_COMPLETED)
+            for t in pending:
+                t.cancel()
+        return None
+
+    async def run(self):
+        await log("info", "worker started", {"worker_id": self.worker_id, "concurrency": self.concurrency})
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        # выходим сами по stopping: отмена посреди aiosqlite.connect оставляет поток соединения,
+        # и процесс потом не может завершиться
+        while not self.stopping.is_set():
+            await self._slots.acquire()
+            try:
+                job_id = await self._next_job()
+            except BaseException:
+                self._slots.release()
+                raise
+            if job_id is None:
+                self._slots.release()
+                continue
+            self._start(job_id)
+
+    def _start(self, job_id: int):
+        admission.on_started(job_id)
+        # задача живёт отдельно от run(): рестарт run() супервизором её не рвёт
+        task = asyncio.create_task(process_job(job_id, self.worker_id))
+        self.inflight[job_id] = task
+        task.add_done_callback(lambda t, j=job_id: self._on_done(j, t))
+
+    def _on_done(self, job_id: int, task: asyncio.Task):
+        self.inflight.pop(job_id, None)
+        self._slots.release()
+        # в статистику длительностей — только успешные задачи
+        ok = not task.cancelled() and task.exception() is None and task.result() is True
+        admission.on_finished(job_id, record=ok)
+
+    async def _heartbeat_loop(self):
+        info = {"pid": os.getpid(), "host": socket.gethostname(), "concurrency": self.concurrency}
+        while not self._closing.is_set():
+            try:
+                cancelled = await worker_heartbeat(self.worker_id, info, list(self.inflight))
+                # отменили через API другого процесса — рвём у себя
+                for job_id in cancelled:
+                    self.cancel_job(job_id)
+                reclaimed = await reclaim_stale_jobs(WORKER_STALE_SEC)
+                if reclaimed:
+                    await log("warning", "reclaimed stale jobs", {"jobs": reclaimed, "worker_id": self.worker_id})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await log("error", "worker heartbeat failed", {"err": str(e)})
+            try:
+                await asyncio.wait_for(self._closing.wait(), timeout=WORKER_HEARTBEAT_SEC)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self.stopping.set()
+
+    async def aclose(self, timeout_s: float = 5.0):
+        """
+        Остановить heartbeat. Зовётся после drain: пока задачи доделываются,
+        воркер должен оставаться живым для reclaim_stale_jobs других процессов.
+        """
+        self.stop()
+        self._closing.set()
+        if self._heartbeat is not None:
+            await asyncio.wait({self._heartbeat}, timeout=timeout_s)
+            self._heartbeat.cancel()
+
+    def cancel_job(self, job_id: int) -> bool:
+        """
+        Отменить выполняющуюся задачу (корутина получит CancelledError,
+        apifree-поллинг отменит задачу и у провайдера — это явная отмена пользователем).
+        """
+        task = self.inflight.get(job_id)
+        if task is None or task.done():
+            return False
+        jobctx.mark_user_cancelled(job_id)
+        task.cancel()
+        return True
+
+
+if __name__ == "__main__":
+    # отдельный процесс-воркер: python -m app.worker
+    from app.lifecycle import run_worker_process
+    asyncio.run(run_worker_process())
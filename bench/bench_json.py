@@ -0,0 +1,90 @@
+"""
+Микро-бенчмарк JSON: stdlib json vs app.jsonx (orjson, если установлен).
+
+Запуск из корня репозитория:
+    python -m bench.bench_json [--n 20000]
+
+Нагрузки похожи на реальные: payload_json задачи, result_json видео/фото
+(как их отдаёт APIFree при поллинге), ответ /api/job и мета лога.
+"""
+import argparse
+import json
+import time
+
+from app import jsonx
+
+
+def _payloads():
+    job_payload = {"prompt": "Кот в космосе, кинематографичный свет, 4k", "lyrics": None, "style": "pop"}
+
+    video_result = {
+        "task_id": "tsk_01HZX8K2N3M4P5Q6R7S8T9V0W",
+        "status": "succeeded",
+        "progress": 100,
+        "created_at": "2026-10-19T10:00:00Z",
+        "output": [{"url": f"https://cdn.example.com/out/{i}.mp4", "width": 1280, "height": 720} for i in range(2)],
+        "_model_url": "https://api.skycoding.ai/v1/model/klingai/kling-v2.6/pro/image-to-video",
+        "metrics": {"predict_time": 183.4, "queue_time": 12.1},
+        "logs": "step 1/50\n" * 50,
+    }
+
+    chat_result = {
+        "text": "Привет! " * 200,
+        "raw": {
+            "id": "chatcmpl-abc",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "Привет! " * 200}}],
+            "usage": {"prompt_tokens": 120, "completion_tokens": 800, "total_tokens": 920},
+        },
+    }
+
+    api_job = {
+        "id": 12345, "tg_id": 777000111, "type": "video", "status": "done",
+        "model": "klingai/kling-v2.6/pro/image-to-video", "prompt": "Кот в космосе",
+        "result": video_result, "error": None,
+    }
+
+    log_meta = {"job_id": 12345, "err": "APIFreeError: model submit failed [502]"}
+
+    return {
+        "job_payload": job_payload,
+        "video_result": video_result,
+        "chat_result": chat_result,
+        "api_job": api_job,
+        "log_meta": log_meta,
+    }
+
+
+def _bench(fn, arg, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    dt = time.perf_counter() - t0
+    return n / dt
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+
+    def std_dumps(x):
+        return json.dumps(x, ensure_ascii=False)
+
+    print(f"jsonx backend: {jsonx.BACKEND}, n={args.n}")
+    print(f"{'payload':<14} {'op':<6} {'stdlib ops/s':>14} {'jsonx ops/s':>14} {'x':>6}")
+
+    for name, obj in _payloads().items():
+        s = std_dumps(obj)
+        b = s.encode("utf-8")
+
+        d_std = _bench(std_dumps, obj, args.n)
+        d_fast = _bench(jsonx.dumps, obj, args.n)
+        print(f"{name:<14} {'dumps':<6} {d_std:>14,.0f} {d_fast:>14,.0f} {d_fast / d_std:>6.1f}")
+
+        l_std = _bench(json.loads, s, args.n)
+        l_fast = _bench(jsonx.loads, b, args.n)
+        print(f"{name:<14} {'loads':<6} {l_std:>14,.0f} {l_fast:>14,.0f} {l_fast / l_std:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import aiosqlite
+
+from app import db, worker
+
+
+def test_queued_jobs_fill_free_slots_at_once(tmp_path, monkeypatch):
+    # отдельный процесс-воркер: in-memory очереди нет, задачи берутся из БД сразу во все слоты
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "app.db"))
+    monkeypatch.setattr(worker, "WORKER_POLL_SEC", 2.0)
+    started = {}
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fake_process_job(job_id, worker_id=None):
+            started[job_id] = time.monotonic()
+            await release.wait()
+            return True
+
+        monkeypatch.setattr(worker, "process_job", fake_process_job)
+
+        await db.init_db()
+        async with aiosqlite.connect(db.DB_PATH) as c:
+            for _ in range(5):
+                await c.execute("INSERT INTO jobs(tg_id, type, status) VALUES (1, 'chat', 'queued')")
+            await c.commit()
+
+        w = worker.Worker(concurrency=4, use_queue=False)
+        t0 = time.monotonic()
+        run = asyncio.create_task(w.run())
+        await asyncio.sleep(0.5)
+        assert sorted(started) == [1, 2, 3, 4]
+        assert max(started.values()) - t0 < 0.5
+
+        w.stop()
+        release.set()
+        await asyncio.wait_for(run, timeout=5)
+        await w.aclose()
+
+    asyncio.run(main())